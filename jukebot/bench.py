@@ -0,0 +1,331 @@
+#!/usr/bin/env python2
+'''
+Benchmark suite of the midi encoding/decoding and preprocessing pipeline.
+Every stage runs on the bundled corpus, repeated to simulate larger corpora,
+in a separate process so that its peak memory can be measured on its own.
+The results are written as JSON, to be compared between versions.
+'''
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from corpus import list_midi_files
+from dataset import bucket_batch_generator, song_windows
+from midi_lib.midi_compress import compress_rows, compress_state_matrix
+from midi_lib.midi_decode import midi_to_sequence_fast
+from midi_lib.midi_runs import concatenate_runs
+from midi_lib.midi_sequence import midi_to_sequence, sequence_to_midi
+from midi_lib.midi_trace import peak_rss
+from midi_lib.midi_volume import insert_volume_into_state_matrix, \
+    remove_volume_from_state_matrix
+
+
+# This script, run once per stage.
+bench_script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 'bench.py')
+
+# The preprocessing used by the `preprocess` stage (same as main.py's).
+bench_row_compression = 10
+bench_prime_size = 50
+bench_batch_size = 32
+
+
+def load_songs(music_dir):
+    """
+    Decodes all the midi files of a directory to dense state-matrices.
+    :param music_dir: The directory containing the midi files.
+    :type music_dir: str
+    :returns: The state-matrix and meta-info of every file.
+    :return_type: list of (2-D numpy array, (int, SetTempoEvent or None))
+    """
+    return [midi_to_sequence_fast(file_path)
+            for file_path in list_midi_files(music_dir)]
+
+
+def decode_python_midi(music_dir, scale):
+    """
+    Stage: decoding of the midi files with python-midi.
+    """
+    file_paths = list_midi_files(music_dir) * scale
+
+    def run():
+        return sum(len(midi_to_sequence(file_path, run_length=True)[0])
+                   for file_path in file_paths)
+    return run
+
+
+def decode_direct(music_dir, scale):
+    """
+    Stage: direct decoding of the midi files.
+    """
+    file_paths = list_midi_files(music_dir) * scale
+
+    def run():
+        return sum(len(midi_to_sequence_fast(file_path, run_length=True)[0])
+                   for file_path in file_paths)
+    return run
+
+
+def compress(music_dir, scale):
+    """
+    Stage: row and column compression of every (dense) song.
+    """
+    songs = load_songs(music_dir)
+
+    def run():
+        nb_ticks = 0
+        for _ in xrange(scale):
+            for state_matrix, _ in songs:
+                compress_state_matrix(state_matrix, bench_row_compression)
+                nb_ticks += len(state_matrix)
+        return nb_ticks
+    return run
+
+
+def volume(music_dir, scale):
+    """
+    Stage: removal and re-insertion of the volume of every (dense) song.
+    """
+    songs = load_songs(music_dir)
+
+    def run():
+        nb_ticks = 0
+        for _ in xrange(scale):
+            for state_matrix, _ in songs:
+                volume_avg = remove_volume_from_state_matrix(state_matrix)
+                insert_volume_into_state_matrix(state_matrix, volume_avg)
+                nb_ticks += len(state_matrix)
+        return nb_ticks
+    return run
+
+
+def preprocess(music_dir, scale):
+    """
+    Stage: concatenation of the (row-compressed) songs into a corpus,
+    column compression, and one epoch of training batches over it (windows
+    within a single song, as in main.py).
+    The speed is given in ticks before row compression.
+    """
+    songs = [midi_to_sequence_fast(file_path, run_length=True)[0]
+             for file_path in list_midi_files(music_dir)]
+    nb_ticks = sum(len(runs) for runs in songs) * scale
+    songs = [compress_rows(runs, bench_row_compression) for runs in songs]
+    song_lengths = [len(runs) for runs in songs] * scale
+    song_offsets = np.cumsum([0] + song_lengths[:-1]).tolist()
+
+    def run():
+        runs, _ = compress_state_matrix(concatenate_runs(songs * scale))
+        buckets = song_windows(zip(song_offsets, song_lengths),
+                               [bench_prime_size])
+        batches = bucket_batch_generator(runs.to_state_matrix(), buckets,
+                                         bench_batch_size, shuffle=False)
+        nb_windows = len(buckets[bench_prime_size])
+        for _ in xrange(-(-nb_windows // bench_batch_size)):
+            next(batches)
+        return nb_ticks
+    return run
+
+
+def encode(music_dir, scale):
+    """
+    Stage: encoding of every (dense) song to a midi file.
+    """
+    songs = load_songs(music_dir)
+
+    def run():
+        out_dir = tempfile.mkdtemp()
+        try:
+            nb_ticks = 0
+            for _ in xrange(scale):
+                for idx, (state_matrix, meta_info) in enumerate(songs):
+                    sequence_to_midi(state_matrix, os.path.join(
+                        out_dir, str(idx) + '.mid'), meta_info)
+                    nb_ticks += len(state_matrix)
+            return nb_ticks
+        finally:
+            shutil.rmtree(out_dir)
+    return run
+
+
+# The stages of the pipeline, in order.
+# Every stage prepares its input and returns a function running the stage,
+# which returns the number of ticks processed.
+benchmark_stages = [
+    ('decode_python_midi', decode_python_midi),
+    ('decode_direct', decode_direct),
+    ('compress', compress),
+    ('volume', volume),
+    ('preprocess', preprocess),
+    ('encode', encode),
+]
+
+
+def run_stage(stage, music_dir, scale):
+    """
+    Runs a single stage of the pipeline in the current process.
+    :param stage: The name of the stage (see benchmark_stages).
+    :type stage: str
+    :param music_dir: The directory containing the midi files.
+    :type music_dir: str
+    :param scale: The number of times the corpus is processed.
+    :type scale: int
+    :returns: The measurements of the stage.
+    :return_type: dict
+    """
+    run = dict(benchmark_stages)[stage](music_dir, scale)
+    rss_before = peak_rss()
+
+    start = time.time()
+    nb_ticks = run()
+    seconds = time.time() - start
+
+    rss_after = peak_rss()
+    return {
+        'stage': stage,
+        'scale': scale,
+        'ticks': nb_ticks,
+        'seconds': seconds,
+        'ticks_per_sec': nb_ticks / seconds if seconds else None,
+        'peak_rss': rss_after,
+        # The memory the stage needed on top of its input.
+        'stage_rss': rss_after - rss_before,
+    }
+
+
+def run_benchmarks(music_dir='music', scales=(1, 10, 100), stages=None):
+    """
+    Runs the stages of the pipeline, each one in a new process.
+    :param music_dir: The directory containing the midi files.
+    :type music_dir: str
+    :param scales: The sizes of the simulated corpora (in copies of the
+     bundled corpus).
+    :type scales: list of int
+    :param stages: The names of the stages to run (defaults to all).
+    :type stages: list of str or None
+    :returns: The measurements of every stage at every scale.
+    :return_type: list of dict
+    """
+    if stages is None:
+        stages = [stage for stage, _ in benchmark_stages]
+
+    results = []
+    for scale in scales:
+        for stage in stages:
+            output = subprocess.check_output([
+                sys.executable, bench_script_path, '--stage', stage,
+                '--scale', str(scale), '--music-dir', music_dir])
+            result = json.loads(output.splitlines()[-1])
+            print_result(result)
+            results.append(result)
+    return results
+
+
+def print_result(result, baseline=None):
+    """
+    Prints the measurements of a stage.
+    :param result: The measurements.
+    :type result: dict
+    :param baseline: The measurements of the same stage to compare with.
+    :type baseline: dict or None
+    :returns: None
+    """
+    line = '%-20s %5dx %12d ticks %8.3fs %12.0f ticks/s %8.1f MB %8.1f MB' % (
+        result['stage'], result['scale'], result['ticks'], result['seconds'],
+        result['ticks_per_sec'] or 0, result['peak_rss'] / 2. ** 20,
+        result['stage_rss'] / 2. ** 20)
+    if baseline is not None and baseline['ticks_per_sec']:
+        line += '  %5.2fx speed' % (
+            result['ticks_per_sec'] / baseline['ticks_per_sec'])
+    print line
+
+
+def compare(results, baseline_results):
+    """
+    Prints the measurements along with their speedup over a previous run.
+    :param results: The measurements.
+    :type results: list of dict
+    :param baseline_results: The measurements of the previous run.
+    :type baseline_results: list of dict
+    :returns: None
+    """
+    baselines = dict(((result['stage'], result['scale']), result)
+                     for result in baseline_results)
+    for result in results:
+        print_result(result, baselines.get((result['stage'], result['scale'])))
+
+
+def add_arguments(parser):
+    """
+    Adds the options of the benchmark to a command-line parser.
+    :param parser: The parser.
+    :type parser: argparse.ArgumentParser
+    :returns: None
+    """
+    parser.add_argument('--music-dir', default='music',
+                        help='directory of the midi files')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100],
+                        help='sizes of the simulated corpora (in copies of '
+                        'the corpus)')
+    parser.add_argument('--stages', nargs='+',
+                        choices=[stage for stage, _ in benchmark_stages],
+                        help='stages to run (defaults to all)')
+    parser.add_argument('-o', '--output',
+                        help='JSON file to write the measurements to')
+    parser.add_argument('--compare', metavar='JSON',
+                        help='measurements of a previous run to compare with')
+
+
+def run(args):
+    """
+    Runs the benchmark as requested on the command-line.
+    :param args: The parsed options (see add_arguments()).
+    :type args: argparse.Namespace
+    :returns: None
+    """
+    print '%-20s %6s %18s %9s %20s %11s %11s' % (
+        'stage', 'scale', 'ticks', 'time', 'speed', 'peak RSS', 'stage RSS')
+    results = run_benchmarks(args.music_dir, args.scales, args.stages)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline_results = json.load(baseline_file)['results']
+        print '\nCompared to "' + args.compare + '":'
+        compare(results, baseline_results)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'music_dir': args.music_dir,
+                'results': results,
+            }, output_file, indent=1, sort_keys=True)
+        print '\nMeasurements written to "' + args.output + '"'
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the midi encoding/decoding and preprocessing '
+        'pipeline.')
+    add_arguments(parser)
+    # Used internally, to run a single stage in its own process.
+    parser.add_argument('--stage', help=argparse.SUPPRESS)
+    parser.add_argument('--scale', type=int, default=1, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        print json.dumps(run_stage(args.stage, args.music_dir, args.scale))
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python2
+'''
+Checkpointing of the training, so that an interrupted training can be
+resumed where it stopped.
+The checkpoints hold the whole model (architecture, weights and optimizer
+state) and are written atomically.
+'''
+import json
+import os
+
+from keras.callbacks import Callback
+from keras.models import load_model
+
+from model_io import mkdir_p
+
+
+# The checkpoints are kept in this sub-directory of the model directory.
+checkpoint_dir_name = 'checkpoints'
+# The last checkpoint, to resume the training from.
+latest_checkpoint_file = 'latest.h5'
+# The checkpoint with the lowest (validation) loss.
+best_checkpoint_file = 'best.h5'
+# The progress of the training (last checkpointed epoch, best loss, history).
+checkpoint_state_file = 'state.json'
+
+
+def get_checkpoint_dir(model_dir):
+    """
+    Finds where the checkpoints of a model are kept.
+    :param model_dir: The directory of the model.
+    :type model_dir: str
+    :returns: The directory of the checkpoints.
+    :return_type: str
+    """
+    return os.path.join(model_dir, checkpoint_dir_name)
+
+
+def read_checkpoint_state(model_dir):
+    """
+    Reads the progress of the training of a model.
+    :param model_dir: The directory of the model.
+    :type model_dir: str
+    :returns: The progress, or None if there is no checkpoint.
+    :return_type: dict or None
+    """
+    state_path = os.path.join(get_checkpoint_dir(model_dir),
+                              checkpoint_state_file)
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path) as state_file:
+        return json.load(state_file)
+
+
+def load_checkpoint(model_dir, best=False):
+    """
+    Loads a checkpointed model, compiled and with its optimizer state.
+    :param model_dir: The directory of the model.
+    :type model_dir: str
+    :param best: Whether to load the best checkpoint instead of the latest.
+    :type best: bool
+    :returns: The model.
+    :return_type: Keras model type
+    """
+    return load_model(os.path.join(
+        get_checkpoint_dir(model_dir),
+        best_checkpoint_file if best else latest_checkpoint_file))
+
+
+def remove_checkpoints(model_dir):
+    """
+    Removes the checkpoints of a model (to train it from scratch).
+    :param model_dir: The directory of the model.
+    :type model_dir: str
+    :returns: None
+    """
+    checkpoint_dir = get_checkpoint_dir(model_dir)
+    for file_name in (checkpoint_state_file, latest_checkpoint_file,
+                      best_checkpoint_file):
+        file_path = os.path.join(checkpoint_dir, file_name)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+class TrainingCheckpoint(Callback):
+    """
+    Keras callback checkpointing the model every few epochs, and whenever
+    the monitored loss reaches a new minimum.
+    """
+
+    def __init__(self, model_dir, period=1, monitor='val_loss', state=None):
+        """
+        :param model_dir: The directory of the model.
+        :type model_dir: str
+        :param period: The number of epochs between checkpoints.
+        :type period: int
+        :param monitor: The loss deciding which checkpoint is the best.
+        :type monitor: str
+        :param state: The progress of the training being resumed, if any.
+        :type state: dict or None
+        """
+        super(TrainingCheckpoint, self).__init__()
+        self.checkpoint_dir = get_checkpoint_dir(model_dir)
+        self.period = period
+        self.monitor = monitor
+        self.state = state or {'epoch': -1, 'best_loss': None,
+                               'best_epoch': None, 'history': []}
+        # The epochs after the latest checkpoint are trained again.
+        del self.state['history'][self.state['epoch'] + 1:]
+
+    def save(self, file_name):
+        """
+        Writes the model to a temporary file first, so that an interruption
+        can never leave a truncated checkpoint behind.
+        """
+        file_path = os.path.join(self.checkpoint_dir, file_name)
+        self.model.save(file_path + '.tmp')
+        os.rename(file_path + '.tmp', file_path)
+
+    def save_state(self):
+        """
+        Writes the progress of the training.
+        """
+        state_path = os.path.join(self.checkpoint_dir, checkpoint_state_file)
+        with open(state_path + '.tmp', 'w') as state_file:
+            json.dump(self.state, state_file, indent=1)
+        os.rename(state_path + '.tmp', state_path)
+
+    def on_train_begin(self, logs=None):
+        mkdir_p(self.checkpoint_dir)
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = dict((key, float(value))
+                    for key, value in (logs or {}).iteritems())
+        self.state['history'].append(logs)
+
+        loss = logs.get(self.monitor)
+        best_loss = self.state['best_loss']
+        is_best = loss is not None and (best_loss is None or loss < best_loss)
+        if is_best:
+            self.save(best_checkpoint_file)
+            self.state['best_loss'] = loss
+            self.state['best_epoch'] = epoch
+
+        is_periodic = (epoch + 1) % self.period == 0 or \
+            epoch + 1 == self.params['nb_epoch']
+        if is_periodic:
+            self.save(latest_checkpoint_file)
+            self.state['epoch'] = epoch
+
+        if is_best or is_periodic:
+            self.save_state()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python2
+'''
+Compact encoding of the states of a corpus as chords.
+A chord is the set of pitches ON in a state, regardless of their volume.
+Only a small number of distinct chords is ever played, so each state can
+be fed to the model as the index of its chord in a vocabulary (through an
+embedding layer) instead of as a vector of all the pitches.
+'''
+import numpy as np
+
+from midi_lib.midi_state import pack_state_matrix, unpack_state_matrix
+
+
+def pack_chords(state_matrix, packed=False):
+    """
+    Packs the pitches ON in every state into bits.
+    :param state_matrix: The state-matrix.
+    :type state_matrix: 2-D numpy array
+    :param packed: Whether the state-matrix is bit-packed already.
+    :type packed: bool
+    :returns: One row of bytes per state.
+    :return_type: 2-D numpy array
+    """
+    if packed:
+        return np.asarray(state_matrix)
+    return pack_state_matrix(state_matrix)
+
+
+def chord_keys(packed_chords):
+    """
+    Views packed chords as scalars, so that they can be sorted and searched.
+    :param packed_chords: The packed chords (see pack_chords()).
+    :type packed_chords: 2-D numpy array
+    :returns: One key per chord.
+    :return_type: 1-D numpy array
+    """
+    packed_chords = np.ascontiguousarray(packed_chords)
+    return packed_chords.view(
+        np.dtype((np.void, packed_chords.shape[1]))).ravel()
+
+
+class ChordVocabulary(object):
+    """
+    The most frequent chords of a corpus. Chord i + 1 is the i-th most
+    frequent one; 0 stands for every chord missing from the vocabulary.
+    """
+
+    def __init__(self, chords, nb_columns):
+        """
+        :param chords: The packed chords, most frequent first.
+        :type chords: 2-D numpy array
+        :param nb_columns: The number of pitches of a state.
+        :type nb_columns: int
+        """
+        self.chords = np.asarray(chords, dtype=np.uint8)
+        self.nb_columns = nb_columns
+        keys = chord_keys(self.chords)
+        self.order = np.argsort(keys)
+        self.sorted_keys = keys[self.order]
+
+    def __len__(self):
+        """
+        The number of chord indices (including the unknown chord).
+        """
+        return len(self.chords) + 1
+
+    @classmethod
+    def from_state_matrix(cls, state_matrix, max_size=None,
+                          chunk_size=1 << 16, nb_columns=None):
+        """
+        Collects the chords of a state-matrix, a chunk of rows at a time
+        (so that it can be memory-mapped).
+        :param state_matrix: The state-matrix.
+        :type state_matrix: 2-D numpy array
+        :param max_size: The number of chords to keep (all if None).
+        :type max_size: int or None
+        :param chunk_size: The number of rows read at a time.
+        :type chunk_size: int
+        :param nb_columns: The number of pitches, if the state-matrix is
+         bit-packed.
+        :type nb_columns: int or None
+        :returns: The vocabulary.
+        :return_type: ChordVocabulary
+        """
+        packed_input = nb_columns is not None
+        if not packed_input:
+            nb_columns = state_matrix.shape[1]
+        counts = {}
+        for start in xrange(0, len(state_matrix), chunk_size):
+            packed = pack_chords(state_matrix[start: start + chunk_size],
+                                 packed_input)
+            keys, key_counts = np.unique(chord_keys(packed),
+                                         return_counts=True)
+            for key, count in zip(keys.tolist(), key_counts.tolist()):
+                counts[key] = counts.get(key, 0) + count
+
+        # The most frequent chords first (ties broken by the chord itself,
+        # so that the vocabulary does not depend on the dict order).
+        keys = sorted(counts, key=lambda key: (-counts[key], key))
+        keys = keys[:max_size]
+        nb_bytes = -(-nb_columns // 8)
+        chords = np.frombuffer(''.join(keys), dtype=np.uint8).reshape(
+            len(keys), nb_bytes)
+        return cls(chords, nb_columns)
+
+    def encode(self, state_matrix, chunk_size=1 << 16, packed=False):
+        """
+        Finds the index of the chord of every state, a chunk of rows at a
+        time (so that the state-matrix can be memory-mapped).
+        :param state_matrix: The state-matrix.
+        :type state_matrix: 2-D numpy array
+        :param chunk_size: The number of rows read at a time.
+        :type chunk_size: int
+        :param packed: Whether the state-matrix is bit-packed.
+        :type packed: bool
+        :returns: The chord indices.
+        :return_type: 1-D numpy array
+        """
+        chord_indices = np.zeros(len(state_matrix), dtype=np.int32)
+        if not len(self.chords):
+            return chord_indices
+        for start in xrange(0, len(state_matrix), chunk_size):
+            keys = chord_keys(pack_chords(
+                state_matrix[start: start + chunk_size], packed))
+            positions = np.searchsorted(self.sorted_keys, keys)
+            positions = np.minimum(positions, len(self.sorted_keys) - 1)
+            found = self.sorted_keys[positions] == keys
+            chord_indices[start: start + len(keys)] = np.where(
+                found, self.order[positions] + 1, 0)
+        return chord_indices
+
+    def decode(self, chord_indices):
+        """
+        Converts chord indices back to (boolean) states.
+        The unknown chord becomes silence.
+        :param chord_indices: The chord indices.
+        :type chord_indices: 1-D numpy array
+        :returns: The state-matrix.
+        :return_type: 2-D numpy array
+        """
+        packed = np.vstack((np.zeros_like(self.chords[:1]), self.chords))
+        return unpack_state_matrix(packed[chord_indices], self.nb_columns)
+
+    def save(self, filepath):
+        """
+        Writes the vocabulary to a file.
+        :param filepath: The path of the file.
+        :type filepath: str
+        :returns: None
+        """
+        with open(filepath, 'wb') as vocabulary_file:
+            np.savez(vocabulary_file, chords=self.chords,
+                     nb_columns=self.nb_columns)
+
+    @classmethod
+    def load(cls, filepath):
+        """
+        Reads a vocabulary written by save().
+        :param filepath: The path of the file.
+        :type filepath: str
+        :returns: The vocabulary.
+        :return_type: ChordVocabulary
+        """
+        entry = np.load(filepath)
+        return cls(entry['chords'], int(entry['nb_columns']))
+
+
+def main():
+    state_matrix = (np.random.rand(1000, 61) > 0.95) * \
+        np.random.randint(1, 128, size=(1000, 61))
+    vocabulary = ChordVocabulary.from_state_matrix(state_matrix, 100,
+                                                   chunk_size=128)
+    print len(vocabulary), 'chord indices'
+    chord_indices = vocabulary.encode(state_matrix)
+    known = chord_indices > 0
+    print known.mean() * 100, '% of the states are in the vocabulary'
+    assert(np.array_equal(vocabulary.decode(chord_indices)[known],
+                          state_matrix[known] > 0))
+    packed = pack_state_matrix(state_matrix)
+    assert(np.array_equal(
+        ChordVocabulary.from_state_matrix(packed, 100, nb_columns=61).chords,
+        vocabulary.chords))
+    assert(np.array_equal(vocabulary.encode(packed, packed=True),
+                          chord_indices))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,416 @@
+#!/usr/bin/env python2
+'''
+Loading of the midi corpus.
+Files are decoded in parallel and their (run-length encoded) state-matrices
+are cached on disk, so that only new or modified files are decoded again.
+The preprocessed corpus is stored as a single memory-mapped state-matrix.
+'''
+import hashlib
+import json
+import os
+from functools import partial
+from multiprocessing import Pool
+
+import midi
+import numpy as np
+
+from midi_lib.midi_compress import compress_rows, compress_state_matrix
+from midi_lib.midi_runs import StateRuns, concatenate_runs
+from midi_lib.midi_decode import midi_to_sequence_fast
+from midi_lib.midi_state import NUM_PITCHES, STATE_DTYPE, pack_state_matrix
+from midi_lib.midi_trace import span, traced
+from midi_lib.midi_volume import remove_volume_from_state_matrix, \
+    velocity_table
+from model_io import mkdir_p
+
+
+# Location of the decoded midi files.
+cache_dir = 'cache'
+# Bumped whenever the decoding changes, so that the files decoded by an
+# older version are decoded again.
+decoder_version = 2
+
+# Default location of the preprocessed corpora (one sub-directory per
+# preprocessing settings), and the files a corpus is made of.
+preprocessed_dir = 'preprocessed'
+preprocessed_states_file = 'states.npy'
+preprocessed_index_file = 'index.json'
+
+# The number of ticks expanded at a time while writing the corpus.
+write_chunk_size = 1 << 16
+
+
+def list_midi_files(music_dir):
+    """
+    Lists all the files inside a directory (recursively), in a stable order.
+    :param music_dir: The directory.
+    :type music_dir: str
+    :returns: The paths of the files.
+    :return_type: list
+    """
+    file_paths = []
+    for subdir, dirs, files in os.walk(music_dir):
+        dirs.sort()
+        for file in sorted(files):
+            file_paths.append(os.path.join(subdir, file))
+    return file_paths
+
+
+def file_signature(file_path):
+    """
+    Identifies the current version of a file.
+    :param file_path: The path of the file.
+    :type file_path: str
+    :returns: The size and the modification time of the file.
+    :return_type: 1-D numpy array
+    """
+    stat = os.stat(file_path)
+    return np.array([stat.st_size, stat.st_mtime], dtype=np.float64)
+
+
+def get_cache_path(file_path, grid=None):
+    """
+    Finds where the decoded version of a file is cached.
+    :param file_path: The path of the midi file.
+    :type file_path: str
+    :param grid: The number of rows per beat the file is quantized to.
+    :type grid: int or None
+    :returns: The path of the cache entry.
+    :return_type: str
+    """
+    key = os.path.abspath(file_path)
+    if grid:
+        key += '@' + str(grid)
+    key = hashlib.sha1(key).hexdigest()
+    return os.path.join(cache_dir, key + '.npz')
+
+
+def encode_tempo_event(tempo_event):
+    """
+    Converts a tempo-event to a plain array (so that it can be cached).
+    :param tempo_event: The tempo-event.
+    :type tempo_event: SetTempoEvent or None
+    :returns: [tick] + data, or an empty array if there is no tempo-event.
+    :return_type: 1-D numpy array
+    """
+    if tempo_event is None:
+        return np.array([], dtype=np.int64)
+    return np.array([tempo_event.tick] + list(tempo_event.data),
+                    dtype=np.int64)
+
+
+def decode_tempo_event(tempo_array):
+    """
+    Inverse of encode_tempo_event().
+    :param tempo_array: The encoded tempo-event.
+    :type tempo_array: 1-D numpy array
+    :returns: The tempo-event.
+    :return_type: SetTempoEvent or None
+    """
+    if not len(tempo_array):
+        return None
+    tempo_array = tempo_array.tolist()
+    return midi.SetTempoEvent(tick=tempo_array[0], data=tempo_array[1:])
+
+
+def read_cache(file_path, grid=None):
+    """
+    Reads the decoded version of a file from the cache.
+    :param file_path: The path of the midi file.
+    :type file_path: str
+    :param grid: The number of rows per beat the file is quantized to.
+    :type grid: int or None
+    :returns: The state-matrix and the meta-info (resolution, tempo_event),
+     or None if the file is not cached or has changed since.
+    :return_type: (StateRuns, (int, SetTempoEvent or None)) or None
+    """
+    cache_path = get_cache_path(file_path, grid)
+    if not os.path.exists(cache_path):
+        return None
+
+    entry = np.load(cache_path)
+    if 'decoder_version' not in entry or \
+            int(entry['decoder_version']) != decoder_version:
+        return None
+    if not np.array_equal(entry['signature'], file_signature(file_path)):
+        return None
+
+    state_matrix = StateRuns(entry['states'], entry['durations'])
+    meta_info = (int(entry['resolution']),
+                 decode_tempo_event(entry['tempo']))
+    return state_matrix, meta_info
+
+
+def decode_file(file_path, grid=None):
+    """
+    Decodes a midi file and stores the result in the cache.
+    Runs in the worker processes of load_corpus().
+    :param file_path: The path of the midi file.
+    :type file_path: str
+    :param grid: The number of rows per beat to quantize the file to.
+    :type grid: int or None
+    :returns: The state-matrix and the meta-info (resolution, tempo_event)
+    :return_type: (StateRuns, (int, SetTempoEvent or None))
+    """
+    signature = file_signature(file_path)
+    state_matrix, (resolution, tempo_event) = midi_to_sequence_fast(
+        file_path, run_length=True, grid=grid)
+
+    # Write to a temporary file first, so that an interrupted run can never
+    # leave a truncated cache entry behind.
+    cache_path = get_cache_path(file_path, grid)
+    temp_path = cache_path + '.' + str(os.getpid()) + '.tmp'
+    with open(temp_path, 'wb') as cache_file:
+        np.savez(cache_file, decoder_version=decoder_version,
+                 signature=signature,
+                 states=state_matrix.states,
+                 durations=state_matrix.durations,
+                 resolution=resolution,
+                 tempo=encode_tempo_event(tempo_event))
+    os.rename(temp_path, cache_path)
+
+    return state_matrix, (resolution, tempo_event)
+
+
+@traced
+def load_corpus(music_dir='music', processes=None, grid=None):
+    """
+    Loads all the midi files of a directory.
+    Only the files which are not in the cache (or have changed since they
+    were cached) are decoded, using a pool of processes.
+    :param music_dir: The directory containing the midi files.
+    :type music_dir: str
+    :param processes: The number of worker processes
+     (defaults to the number of CPUs).
+    :type processes: int or None
+    :param grid: The number of rows per beat to quantize the files to
+     (None keeps one row per tick).
+    :type grid: int or None
+    :returns: The path, state-matrix and meta-info of every file.
+    :return_type: list of (str, StateRuns, (int, SetTempoEvent or None))
+    """
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    file_paths = list_midi_files(music_dir)
+    songs = dict((file_path, read_cache(file_path, grid))
+                 for file_path in file_paths)
+
+    stale_paths = [file_path for file_path in file_paths
+                   if songs[file_path] is None]
+    if stale_paths:
+        print 'Decoding', len(stale_paths), 'of', len(file_paths), 'files ...\n'
+        if processes == 1 or len(stale_paths) == 1:
+            decoded = map(partial(decode_file, grid=grid), stale_paths)
+        else:
+            pool = Pool(processes)
+            try:
+                decoded = pool.map(partial(decode_file, grid=grid),
+                                   stale_paths)
+            finally:
+                pool.close()
+                pool.join()
+        songs.update(zip(stale_paths, decoded))
+
+    return [(file_path,) + songs[file_path] for file_path in file_paths]
+
+
+@traced
+def get_corpus_dir(settings, root_dir=preprocessed_dir):
+    """
+    Finds where the corpus preprocessed with given settings is kept by
+    default, so that corpora built with different settings (e.g. by
+    parallel runs) never overwrite each other.
+    :param settings: The keyword arguments passed to build_corpus().
+    :type settings: dict
+    :param root_dir: The directory of all the preprocessed corpora.
+    :type root_dir: str
+    :returns: The directory of the corpus.
+    :return_type: str
+    """
+    digest = hashlib.sha1(json.dumps(settings, sort_keys=True)).hexdigest()
+    return os.path.join(root_dir, digest)
+
+
+def build_corpus(music_dir='music', row_compression_batch_size=0,
+                 row_compression_strategy='mean', column_compression=True,
+                 boolean=False, velocity_period=1, pack=False, grid=None,
+                 corpus_dir=preprocessed_dir):
+    """
+    Preprocesses all the midi files of a directory and writes the result
+    as a single (uint8) state-matrix, along with an index describing the
+    songs it is made of.
+    The songs are kept run-length encoded until they are written,
+    so the memory used does not depend on the length of the corpus.
+    :param music_dir: The directory containing the midi files.
+    :type music_dir: str
+    :param row_compression_batch_size: The number of rows to group together
+     (0 disables row-compression).
+    :type row_compression_batch_size: int
+    :param row_compression_strategy: The row-compression strategy
+     (see row_compression_strategies).
+    :type row_compression_strategy: str
+    :param column_compression: Whether to drop the pitches which are never ON.
+    :type column_compression: bool
+    :param boolean: Whether to convert the state-matrix to boolean format.
+    :type boolean: bool
+    :param velocity_period: The number of rows of the cycle the velocity
+     table of a boolean corpus is learned over (see velocity_table()).
+    :type velocity_period: int
+    :param pack: Whether to store the (boolean) state-matrix bit-packed,
+     8 pitches per byte (see pack_state_matrix()).
+    :type pack: bool
+    :param grid: The number of rows per beat to quantize the songs to, so
+     that a row lasts as long in every song whatever its resolution (None
+     keeps one row per tick).
+    :type grid: int or None
+    :param corpus_dir: The directory to write the corpus to.
+    :type corpus_dir: str
+    :returns: The index of the corpus.
+    :return_type: dict
+    """
+    if pack and not boolean:
+        raise ValueError('Only boolean corpora can be bit-packed')
+
+    songs = []
+    song_runs = []
+    offset = 0
+    for file_path, runs, (resolution, tempo_event) in load_corpus(
+            music_dir, grid=grid):
+        # Each song is row-compressed separately, so that no row mixes
+        # the end of a song with the beginning of the next one.
+        if row_compression_batch_size:
+            runs = compress_rows(runs, row_compression_batch_size,
+                                 row_compression_strategy)
+        song_runs.append(runs)
+        songs.append({
+            'path': file_path,
+            'signature': file_signature(file_path).tolist(),
+            'offset': offset,
+            'length': len(runs),
+            'resolution': resolution,
+            'tempo': encode_tempo_event(tempo_event).tolist(),
+        })
+        offset += len(runs)
+
+    state_matrix = concatenate_runs(song_runs)
+    columns_present = np.arange(NUM_PITCHES)
+    if column_compression:
+        state_matrix, columns_present = compress_state_matrix(state_matrix)
+    volume_avg = None
+    table = None
+    if boolean:
+        # The volumes of the notes are only kept as a velocity table.
+        table = velocity_table(song_runs, velocity_period)[:, columns_present]
+        volume_avg = remove_volume_from_state_matrix(state_matrix)
+
+    mkdir_p(corpus_dir)
+    # The index is written last; an incomplete corpus has no index.
+    index_path = os.path.join(corpus_dir, preprocessed_index_file)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+    # The files are written under temporary names and renamed into place,
+    # so that a process still reading (memory-mapping) the previous corpus
+    # keeps its own copy instead of seeing it truncated.
+    temp_suffix = '.' + str(os.getpid()) + '.tmp'
+    states_path = os.path.join(corpus_dir, preprocessed_states_file)
+
+    with span('write_corpus') as write_span:
+        nb_columns = state_matrix.nb_columns
+        if pack:
+            nb_columns = -(-nb_columns // 8)
+        states = np.lib.format.open_memmap(
+            states_path + temp_suffix, mode='w+',
+            dtype=STATE_DTYPE, shape=(len(state_matrix), nb_columns))
+        for start, chunk in zip(xrange(0, len(states), write_chunk_size),
+                                state_matrix.iter_chunks(write_chunk_size)):
+            if pack:
+                chunk = pack_state_matrix(chunk)
+            states[start: start + len(chunk)] = chunk
+        states.flush()
+        write_span.set(states=states)
+        del states
+    os.rename(states_path + temp_suffix, states_path)
+
+    index = {
+        'decoder_version': decoder_version,
+        'settings': {
+            'music_dir': music_dir,
+            'row_compression_batch_size': row_compression_batch_size,
+            'row_compression_strategy': row_compression_strategy,
+            'column_compression': column_compression,
+            'boolean': boolean,
+            'velocity_period': velocity_period,
+            'pack': pack,
+            'grid': grid,
+        },
+        'columns_present': columns_present.tolist(),
+        'volume_avg': volume_avg,
+        'velocity_table': table.tolist() if table is not None else None,
+        'songs': songs,
+    }
+    with open(index_path + temp_suffix, 'w') as index_file:
+        json.dump(index, index_file, indent=1)
+    os.rename(index_path + temp_suffix, index_path)
+
+    return index
+
+
+def read_corpus_index(corpus_dir=preprocessed_dir):
+    """
+    Reads the index of the preprocessed corpus.
+    :param corpus_dir: The directory of the corpus.
+    :type corpus_dir: str
+    :returns: The index, or None if there is no (complete) corpus.
+    :return_type: dict or None
+    """
+    index_path = os.path.join(corpus_dir, preprocessed_index_file)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path) as index_file:
+        return json.load(index_file)
+
+
+def corpus_is_current(index, settings):
+    """
+    Checks whether the preprocessed corpus was built with the given settings
+    from the files which are currently in the music directory.
+    :param index: The index of the corpus.
+    :type index: dict or None
+    :param settings: The keyword arguments which would be passed to
+     build_corpus().
+    :type settings: dict
+    :returns: Whether the corpus can be used as is.
+    :return_type: bool
+    """
+    if index is None or index['settings'] != settings:
+        return False
+    if index.get('decoder_version') != decoder_version:
+        return False
+
+    file_paths = list_midi_files(settings['music_dir'])
+    if file_paths != [song['path'] for song in index['songs']]:
+        return False
+    return all(file_signature(song['path']).tolist() == song['signature']
+               for song in index['songs'])
+
+
+def open_corpus(corpus_dir=preprocessed_dir):
+    """
+    Opens the preprocessed corpus.
+    The state-matrix is memory-mapped (read-only) rather than read,
+    so corpora larger than the memory can be used. It is bit-packed if the
+    corpus was built with pack=True.
+    :param corpus_dir: The directory of the corpus.
+    :type corpus_dir: str
+    :returns: The state-matrix and the index of the corpus.
+    :return_type: (2-D numpy memmap, dict)
+    """
+    index = read_corpus_index(corpus_dir)
+    if index is None:
+        raise IOError('No preprocessed corpus found in "' +
+                      corpus_dir + '"')
+    state_matrix = np.load(os.path.join(corpus_dir, preprocessed_states_file),
+                           mmap_mode='r')
+    return state_matrix, index
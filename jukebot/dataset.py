@@ -0,0 +1,274 @@
+#!/usr/bin/env python2
+'''
+Training datasets built on top of a state-matrix without copying it.
+'''
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from midi_lib.midi_state import unpack_state_matrix
+from midi_lib.midi_trace import span
+
+
+def sliding_windows(state_matrix, prime_size, step_size=1):
+    """
+    Views the state-matrix as overlapping windows of prime_size rows,
+    each followed by its target row.
+    X[i] = state_matrix[i * step_size: i * step_size + prime_size]
+    Y[i] = state_matrix[i * step_size + prime_size]
+    No data is copied; X and Y are read-only views into the state-matrix.
+    :param state_matrix: The state-matrix.
+    :type state_matrix: 2-D numpy array
+    :param prime_size: The number of rows in a single datapoint.
+    :type prime_size: int
+    :param step_size: The number of rows between consecutive datapoints.
+    :type step_size: int
+    :returns: The datapoints and the corresponding target output values.
+    :return_type: (3-D numpy array, 2-D numpy array)
+    """
+    state_matrix = np.ascontiguousarray(state_matrix)
+    nb_rows, nb_columns = state_matrix.shape
+    nb_windows = max(0, -(-(nb_rows - prime_size) // step_size))
+
+    row_stride, column_stride = state_matrix.strides
+    X = as_strided(state_matrix,
+                   shape=(nb_windows, prime_size, nb_columns),
+                   strides=(row_stride * step_size, row_stride, column_stride),
+                   writeable=False)
+    Y = state_matrix[prime_size::step_size][:nb_windows]
+    Y.flags.writeable = False
+
+    return X, Y
+
+
+def song_windows(songs, window_sizes, step_size=1):
+    """
+    Finds the windows (followed by their target row) which lie entirely
+    within a single song of a corpus, so that no window mixes the end of a
+    song with the beginning of the next one.
+    The windows are bucketed by size: every song is cut into windows of the
+    largest size it can hold, so short songs still provide (shorter)
+    windows.
+    :param songs: The offset and length (in rows) of every song of the
+     corpus.
+    :type songs: list of (int, int)
+    :param window_sizes: The allowed window sizes.
+    :type window_sizes: list of int
+    :param step_size: The number of rows between consecutive windows.
+    :type step_size: int
+    :returns: The first row of every window, for every window size.
+    :return_type: dict of int to 1-D numpy array
+    """
+    window_sizes = sorted(window_sizes, reverse=True)
+    starts = dict((window_size, []) for window_size in window_sizes)
+    for offset, length in songs:
+        for window_size in window_sizes:
+            if window_size < length:
+                starts[window_size].append(np.arange(
+                    offset, offset + length - window_size, step_size))
+                break
+    return dict((window_size, np.concatenate(song_starts).astype(np.int64)
+                 if song_starts else np.array([], dtype=np.int64))
+                for window_size, song_starts in starts.iteritems())
+
+
+def split_buckets(buckets, validation_split):
+    """
+    Splits the windows of every bucket into a training and a validation set
+    (see split_indices()).
+    :param buckets: The first row of every window, for every window size.
+    :type buckets: dict of int to 1-D numpy array
+    :param validation_split: The fraction of windows used for validation.
+    :type validation_split: float
+    :returns: The training and the validation buckets.
+    :return_type: (dict of int to 1-D numpy array,
+     dict of int to 1-D numpy array)
+    """
+    train_buckets, val_buckets = {}, {}
+    for window_size, starts in buckets.iteritems():
+        train_indices, val_indices = split_indices(len(starts),
+                                                   validation_split)
+        train_buckets[window_size] = starts[train_indices]
+        val_buckets[window_size] = starts[val_indices]
+    return train_buckets, val_buckets
+
+
+def transposition_sources(columns_present, max_shift):
+    """
+    Finds, for every transposition of up to max_shift semitones, the column
+    each pitch of a (column-compressed) state is read from.
+    A pitch whose source is not among the columns present is silent, and
+    the pitches shifted out of the columns present are dropped.
+    :param columns_present: The pitch of every column.
+    :type columns_present: list
+    :param max_shift: The largest transposition, up or down.
+    :type max_shift: int
+    :returns: The column every column is read from, for every transposition
+     (len(columns_present) stands for silence).
+    :return_type: 2-D numpy array
+    """
+    columns_present = np.asarray(columns_present)
+    shifts = np.arange(-max_shift, max_shift + 1)
+    source_pitches = columns_present - shifts[:, np.newaxis]
+    sources = np.searchsorted(columns_present, source_pitches)
+    clipped = np.minimum(sources, len(columns_present) - 1)
+    return np.where(columns_present[clipped] == source_pitches, sources,
+                    len(columns_present))
+
+
+def transpose_batch(batch, sources):
+    """
+    Transposes every datapoint of a batch (see transposition_sources()).
+    :param batch: The datapoints.
+    :type batch: 3-D numpy array
+    :param sources: The column every column is read from, for every
+     datapoint.
+    :type sources: 2-D numpy array
+    :returns: The transposed datapoints.
+    :return_type: 3-D numpy array
+    """
+    silence = np.zeros(batch.shape[:2] + (1,), dtype=batch.dtype)
+    return np.take_along_axis(np.concatenate((batch, silence), axis=2),
+                              sources[:, np.newaxis, :], axis=2)
+
+
+def stretched_rows(starts, window_size, max_stretch, song_ends):
+    """
+    Draws a random tempo for every window, and finds the rows the window
+    (and its target row) is resampled from.
+    Slowing down repeats rows; speeding up skips rows, and is limited so
+    that the window stays within its song.
+    :param starts: The first row of every window.
+    :type starts: 1-D numpy array
+    :param window_size: The number of rows of a window.
+    :type window_size: int
+    :param max_stretch: The largest factor the windows are slowed down or
+     sped up by.
+    :type max_stretch: float
+    :param song_ends: The row following the song of every window.
+    :type song_ends: 1-D numpy array
+    :returns: The rows of every window, followed by its target row.
+    :return_type: 2-D numpy array
+    """
+    log_stretch = np.log(max_stretch)
+    factors = np.exp(np.random.uniform(-log_stretch, log_stretch,
+                                       size=len(starts)))
+    # floor(window_size / factor) must stay before the end of the song.
+    factors = np.maximum(factors,
+                         (window_size + 1.) / (song_ends - starts))
+    offsets = np.floor(np.arange(window_size + 1) /
+                       factors[:, np.newaxis]).astype(np.int64)
+    return starts[:, np.newaxis] + offsets
+
+
+def bucket_batch_generator(state_matrix, buckets, batch_size=32,
+                           shuffle=True, inputs=None, nb_columns=None,
+                           transpositions=None, max_stretch=None,
+                           songs=None):
+    """
+    Endlessly yields batches of windows of a state-matrix for Keras'
+    fit_generator(). All the windows of a batch have the same size, so
+    batches need no padding; only the last batch of each bucket is smaller.
+    :param state_matrix: The state-matrix.
+    :type state_matrix: 2-D numpy array
+    :param buckets: The first row of every window, for every window size
+     (see song_windows()).
+    :type buckets: dict of int to 1-D numpy array
+    :param batch_size: The number of windows in a batch.
+    :type batch_size: int
+    :param shuffle: Whether to visit the windows (and the batches) in a
+     random order (re-drawn every epoch).
+    :type shuffle: bool
+    :param inputs: What the model is fed for each row instead of the row
+     itself (e.g. chord indices), if anything.
+    :type inputs: 1-D numpy array or None
+    :param nb_columns: The number of pitches, if the state-matrix is
+     bit-packed (see pack_state_matrix()). The batches are unpacked one at
+     a time.
+    :type nb_columns: int or None
+    :param transpositions: The transpositions every window is randomly
+     transposed by (see transposition_sources()), if any.
+    :type transpositions: 2-D numpy array or None
+    :param max_stretch: The largest factor every window is randomly slowed
+     down or sped up by (see stretched_rows()), if any.
+    :type max_stretch: float or None
+    :param songs: The offset and length of every song (with max_stretch).
+    :type songs: list of (int, int) or None
+    :returns: Batches of (datapoints, target output values).
+    :return_type: generator of (3-D numpy array or 2-D numpy array,
+     2-D numpy array)
+    """
+    # With a step of 1, window i of sliding_windows() starts at row i.
+    windows = dict((window_size, sliding_windows(state_matrix, window_size))
+                   for window_size in buckets)
+    if transpositions is not None and inputs is not None:
+        raise ValueError('The inputs of a batch cannot be transposed')
+    stretched = max_stretch is not None
+    if stretched:
+        song_offsets, song_lengths = np.array(songs, dtype=np.int64).T
+    if inputs is not None:
+        input_windows = dict(
+            (window_size,
+             sliding_windows(inputs[:, np.newaxis], window_size)[0])
+            for window_size in buckets)
+
+    while True:
+        batches = []
+        for window_size in sorted(buckets):
+            starts = buckets[window_size]
+            if shuffle:
+                starts = np.random.permutation(starts)
+            batches.extend((window_size, starts[start: start + batch_size])
+                           for start in xrange(0, len(starts), batch_size))
+        if shuffle:
+            batches = [batches[idx]
+                       for idx in np.random.permutation(len(batches))]
+
+        for window_size, batch in batches:
+            X, Y = windows[window_size]
+            with span('window_batch'):
+                batch = np.sort(batch)
+                if stretched:
+                    song_idx = np.searchsorted(song_offsets, batch,
+                                               side='right') - 1
+                    rows = stretched_rows(
+                        batch, window_size, max_stretch,
+                        song_offsets[song_idx] + song_lengths[song_idx])
+
+                # Fancy indexing only copies the rows of the batch.
+                if inputs is not None:
+                    X_batch = inputs[rows[:, :-1]] if stretched else \
+                        input_windows[window_size][batch][:, :, 0]
+                else:
+                    X_batch = state_matrix[rows[:, :-1]] if stretched else \
+                        X[batch]
+                    if nb_columns is not None:
+                        X_batch = unpack_state_matrix(X_batch, nb_columns)
+                Y_batch = state_matrix[rows[:, -1]] if stretched else Y[batch]
+                if nb_columns is not None:
+                    Y_batch = unpack_state_matrix(Y_batch, nb_columns)
+
+                if transpositions is not None:
+                    sources = transpositions[np.random.randint(
+                        len(transpositions), size=len(batch))]
+                    X_batch = transpose_batch(X_batch, sources)
+                    Y_batch = transpose_batch(Y_batch[:, np.newaxis],
+                                              sources)[:, 0]
+                if inputs is None:
+                    X_batch = X_batch.astype(np.float32)
+                Y_batch = Y_batch.astype(np.float32)
+            yield X_batch, Y_batch
+
+
+def split_indices(nb_datapoints, validation_split):
+    """
+    Splits the datapoints into a training and a validation set.
+    Like Keras, the last datapoints are used for validation.
+    :param nb_datapoints: The number of datapoints.
+    :type nb_datapoints: int
+    :param validation_split: The fraction of datapoints used for validation.
+    :type validation_split: float
+    :returns: The indices of the training and the validation datapoints.
+    :return_type: (1-D numpy array, 1-D numpy array)
+    """
+    split_at = int(nb_datapoints * (1. - validation_split))
+    return np.arange(split_at), np.arange(split_at, nb_datapoints)
@@ -0,0 +1,684 @@
+#!/usr/bin/env python2
+'''
+Autoregressive generation of music with a trained model.
+Can be run on its own to generate music with the saved model, without
+loading the corpus. Keras is only imported once a model is needed.
+'''
+import argparse
+import copy
+import datetime
+import os
+from itertools import imap, izip, tee
+from multiprocessing import Process, Queue, cpu_count
+from operator import itemgetter
+from Queue import Full
+
+import numpy as np
+
+from chords import ChordVocabulary
+from corpus import decode_tempo_event, list_midi_files
+from midi_lib.midi_compress import compress_rows, decompress_rows, \
+    decompress_state_matrix
+from midi_lib.midi_decode import midi_to_sequence_fast
+from midi_lib.midi_runs import StateRuns
+from midi_lib.midi_sequence import MidiStreamWriter
+from midi_lib.midi_state import STATE_DTYPE
+from midi_lib.midi_threshold import NoteDecoder
+from midi_lib.midi_trace import span, traced
+from midi_lib.midi_volume import insert_volume_into_state_matrix
+from model_io import load_model, load_model_meta, model_chords_file, \
+    model_exists, model_save_dir
+
+
+# The number of chunks generated ahead of a writer process.
+max_queued_chunks = 4
+
+
+def make_stateful(model, batch_size=1):
+    """
+    Builds a copy of the model which processes a single tick per call,
+    its LSTM layers keeping their state from one call to the next.
+    :param model: The (trained) model.
+    :type model: Keras Sequential model
+    :param batch_size: The number of sequences processed at a time.
+    :type batch_size: int
+    :returns: The stateful model (sharing the weights of the input model).
+    :return_type: Keras Sequential model
+    """
+    from keras.models import Sequential
+
+    config = copy.deepcopy(model.get_config())
+    for layer in config:
+        if layer['class_name'] == 'LSTM':
+            layer['config']['stateful'] = True
+    first_layer = config[0]['config']
+    if config[0]['class_name'] == 'Embedding':
+        # The model takes chord indices (see ChordVocabulary).
+        first_layer['batch_input_shape'] = [batch_size, 1]
+        first_layer['input_length'] = 1
+    else:
+        first_layer['batch_input_shape'] = [
+            batch_size, 1, first_layer['batch_input_shape'][-1]]
+
+    stateful_model = Sequential.from_config(config)
+    stateful_model.set_weights(model.get_weights())
+    return stateful_model
+
+
+def sample_state(prediction, temperature=0., boolean=False, rng=np.random):
+    """
+    Converts the output of the model to a state.
+    :param prediction: The output of the model.
+    :type prediction: numpy array
+    :param temperature: The standard deviation of the gaussian noise added to
+     the prediction (0 makes the generation deterministic).
+    :type temperature: float
+    :param boolean: Whether the model works on boolean states.
+    :type boolean: bool
+    :param rng: The random number generator.
+    :type rng: numpy RandomState
+    :returns: The state.
+    :return_type: numpy array
+    """
+    if temperature:
+        prediction = prediction + rng.normal(0., temperature, prediction.shape)
+    if boolean:
+        return np.around(prediction).clip(min=0, max=1).astype(STATE_DTYPE)
+    return prediction.clip(min=0, max=127).astype(STATE_DTYPE)
+
+
+def generate_batch(model, primes, nb_steps, temperatures=None,
+                   boolean=False, chunk_size=256, seeds=None, chords=None):
+    """
+    Generates several independent pieces of music at once (as one batch),
+    one tick at a time, each tick being fed back into the model to predict
+    the next one. A tick costs a single LSTM timestep for the whole batch.
+    :param model: The (trained) model.
+    :type model: Keras Sequential model
+    :param primes: The ticks to start each piece from (typically windows of
+     the corpus).
+    :type primes: 3-D numpy array
+    :param nb_steps: The number of ticks to generate.
+    :type nb_steps: int
+    :param temperatures: The temperature of each piece (see sample_state()).
+    :type temperatures: list of float or None
+    :param boolean: Whether the model works on boolean states.
+    :type boolean: bool
+    :param chunk_size: The number of ticks yielded at a time.
+    :type chunk_size: int
+    :param seeds: The seed of the random number generator of each piece.
+    :type seeds: list of int or None
+    :param chords: The chord vocabulary, if the model takes chord indices.
+    :type chords: ChordVocabulary or None
+    :returns: The generated ticks of every piece, chunk by chunk.
+    :return_type: generator of 3-D numpy array
+    """
+    def model_input(states):
+        """
+        Converts states (B x T x columns) to the input of the model.
+        """
+        if chords is None:
+            return states.astype(np.float32)
+        return chords.encode(states.reshape(-1, nb_columns)).reshape(
+            states.shape[:2])
+
+    batch_size, _, nb_columns = primes.shape
+    if temperatures is None:
+        temperatures = [0.] * batch_size
+    if seeds is None:
+        seeds = [None] * batch_size
+    rngs = [np.random.RandomState(seed) for seed in seeds]
+
+    with span('make_stateful'):
+        stateful_model = make_stateful(model, batch_size)
+        stateful_model.reset_states()
+
+    # Warm up the state of the LSTM layers with the primes.
+    prediction = None
+    with span('warm_up', primes=primes):
+        for tick in xrange(primes.shape[1]):
+            prediction = stateful_model.predict_on_batch(
+                model_input(primes[:, tick: tick + 1]))
+
+    chunk = np.empty((batch_size, chunk_size, nb_columns), dtype=STATE_DTYPE)
+    for step in xrange(nb_steps):
+        for idx in xrange(batch_size):
+            chunk[idx, step % chunk_size] = sample_state(
+                prediction[idx], temperatures[idx], boolean, rngs[idx])
+        if step % chunk_size == chunk_size - 1:
+            yield chunk.copy()
+        if step < nb_steps - 1:
+            prediction = stateful_model.predict_on_batch(
+                model_input(chunk[:, step % chunk_size, np.newaxis]))
+
+    if nb_steps % chunk_size:
+        yield chunk[:, :nb_steps % chunk_size].copy()
+
+
+def insert_volume_stream(chunks, volume_avg, start=0):
+    """
+    Post-processing stage: restores the volume of boolean ticks.
+    :param chunks: The generated ticks of a piece, chunk by chunk.
+    :type chunks: iterable of 2-D numpy array
+    :param volume_avg: The volume of the notes (or their velocity table).
+    :type volume_avg: int or 2-D numpy array
+    :param start: The position in the cycle of the velocity table of the
+     first tick.
+    :type start: int
+    :returns: The ticks (modified in place), chunk by chunk.
+    :return_type: generator of 2-D numpy array
+    """
+    for chunk in chunks:
+        insert_volume_into_state_matrix(chunk, volume_avg, start)
+        start += len(chunk)
+        yield chunk
+
+
+def decode_notes_stream(chunks, note_decoding):
+    """
+    Decodes the notes of generated ticks, dropping the flickering and the
+    too short ones (see NoteDecoder).
+    :param chunks: The generated ticks, chunk by chunk.
+    :type chunks: iterable of 2-D numpy array
+    :param note_decoding: The ON threshold, OFF threshold and minimum
+     duration of the notes.
+    :type note_decoding: (int or None, int or None, int)
+    :returns: The decoded ticks, chunk by chunk (one more chunk than
+     chunks, with the ticks held back by the decoder).
+    :return_type: generator of 2-D numpy array
+    """
+    decoder = NoteDecoder(*note_decoding)
+    for chunk in chunks:
+        yield decoder.decode(chunk)
+    yield decoder.finish()
+
+
+def postprocess_stream(chunks, columns_present=None, volume_avg=None,
+                       row_compression=None, note_decoding=None,
+                       volume_start=0):
+    """
+    Chains the stages converting generated ticks back to a (full)
+    state-matrix. Every stage is a generator consuming the chunks of the
+    previous one, so a piece of any length is post-processed in constant
+    memory, as it is being generated.
+    :param chunks: The generated ticks of a piece, chunk by chunk.
+    :type chunks: iterable of 2-D numpy array
+    :param columns_present: The pitches kept by column-compression, if any.
+    :type columns_present: list or None
+    :param volume_avg: The volume of the notes (or their velocity table),
+     if the model is boolean.
+    :type volume_avg: int or 2-D numpy array or None
+    :param row_compression: The row-compression batch size and strategy,
+     if any.
+    :type row_compression: (int, str) or None
+    :param note_decoding: See decode_notes_stream() (no decoding if None).
+     The thresholds apply to the volumes, once they are restored.
+    :type note_decoding: (int or None, int or None, int) or None
+    :param volume_start: See insert_volume_stream().
+    :type volume_start: int
+    :returns: The state-matrix, chunk by chunk.
+    :return_type: generator of 2-D numpy array
+    """
+    if volume_avg is not None:
+        chunks = insert_volume_stream(chunks, volume_avg, volume_start)
+    if note_decoding is not None:
+        chunks = decode_notes_stream(chunks, note_decoding)
+    if columns_present is not None:
+        chunks = (decompress_state_matrix(chunk, columns_present)
+                  for chunk in chunks)
+    if row_compression is not None:
+        chunks = (decompress_rows(chunk, *row_compression)
+                  for chunk in chunks)
+    return chunks
+
+
+def split_pieces(chunks, nb_pieces):
+    """
+    Splits the chunks of a batch of pieces into one stream per piece.
+    The streams are meant to be consumed in lockstep (e.g. with izip()),
+    so that a single chunk is buffered at a time.
+    :param chunks: The ticks of the pieces, chunk by chunk.
+    :type chunks: iterable of 3-D numpy array
+    :param nb_pieces: The number of pieces.
+    :type nb_pieces: int
+    :returns: The ticks of every piece, chunk by chunk.
+    :return_type: list of iterators of 2-D numpy array
+    """
+    return [imap(itemgetter(idx), stream)
+            for idx, stream in enumerate(tee(chunks, nb_pieces))]
+
+
+def write_pieces(chunks, file_paths, meta_info, postprocess_args,
+                 volume_starts=None):
+    """
+    Post-processes a batch of pieces and writes each of them as a midi file,
+    one chunk at a time.
+    :param chunks: The generated ticks of the pieces, chunk by chunk.
+    :type chunks: iterable of 3-D numpy array
+    :param file_paths: The path of the output midi file of each piece.
+    :type file_paths: list
+    :param meta_info: Resolution and tempo-event of the output midi files.
+    :type meta_info: (int, SetTempoEvent or None)
+    :param postprocess_args: The arguments of postprocess_stream() (after
+     the chunks).
+    :type postprocess_args: tuple
+    :param volume_starts: The position in the cycle of the velocity table
+     of the first tick of each piece (0 if None).
+    :type volume_starts: list of int or None
+    :returns: None
+    """
+    if volume_starts is None:
+        volume_starts = [0] * len(file_paths)
+    out_files = [MidiStreamWriter(file_path, meta_info)
+                 for file_path in file_paths]
+    pieces = [postprocess_stream(piece, *postprocess_args,
+                                 volume_start=volume_start)
+              for piece, volume_start in zip(
+                  split_pieces(chunks, len(file_paths)), volume_starts)]
+    for piece_chunks in izip(*pieces):
+        with span('write_chunk'):
+            for out_file, chunk in zip(out_files, piece_chunks):
+                out_file.write(chunk)
+    for out_file in out_files:
+        out_file.close()
+
+
+def queued_chunks(queue):
+    """
+    Yields the chunks put on a queue, until None is.
+    :param queue: The queue.
+    :type queue: multiprocessing.Queue
+    :returns: The chunks.
+    :return_type: generator of numpy array
+    """
+    while True:
+        chunk = queue.get()
+        if chunk is None:
+            return
+        yield chunk
+
+
+def write_queued_pieces(queue, file_paths, meta_info, postprocess_args,
+                        volume_starts):
+    """
+    Runs in the writer processes of generate_to_files(): writes the pieces
+    whose chunks are put on the queue.
+    """
+    write_pieces(queued_chunks(queue), file_paths, meta_info,
+                 postprocess_args, volume_starts)
+
+
+def put_chunk(queue, chunk, writer):
+    """
+    Hands a chunk to a writer process, waiting while its queue is full.
+    :param queue: The queue of the writer process.
+    :type queue: multiprocessing.Queue
+    :param chunk: The chunk (None once the pieces are complete).
+    :type chunk: 3-D numpy array or None
+    :param writer: The writer process.
+    :type writer: multiprocessing.Process
+    :returns: None
+    """
+    while True:
+        try:
+            queue.put(chunk, timeout=1.)
+            return
+        except Full:
+            if not writer.is_alive():
+                raise RuntimeError('A writer process exited with code ' +
+                                   str(writer.exitcode))
+
+
+def generate_to_files(model, primes, nb_steps, file_paths, meta_info,
+                      temperatures=None, boolean=False, seeds=None,
+                      columns_present=None, volume_avg=None,
+                      row_compression=None, processes=None, chords=None,
+                      note_decoding=None, volume_starts=None):
+    """
+    Generates several pieces of music at once and writes each of them as a
+    midi file.
+    The pieces are post-processed and written chunk by chunk, by writer
+    processes running while the next chunks are generated; the memory used
+    does not depend on the length of the pieces.
+    :param model: The (trained) model.
+    :type model: Keras Sequential model
+    :param primes: The ticks to start each piece from.
+    :type primes: 3-D numpy array
+    :param nb_steps: The number of ticks to generate.
+    :type nb_steps: int
+    :param file_paths: The path of the output midi file of each piece.
+    :type file_paths: list
+    :param meta_info: Resolution and tempo-event of the output midi files.
+    :type meta_info: (int, SetTempoEvent or None)
+    :param temperatures: See generate_batch().
+    :type temperatures: list of float or None
+    :param boolean: Whether the model works on boolean states.
+    :type boolean: bool
+    :param seeds: See generate_batch().
+    :type seeds: list of int or None
+    :param columns_present: See postprocess_stream().
+    :type columns_present: list or None
+    :param volume_avg: See postprocess_stream().
+    :type volume_avg: int or 2-D numpy array or None
+    :param row_compression: See postprocess_stream().
+    :type row_compression: (int, str) or None
+    :param processes: The number of writer processes (defaults to the number
+     of CPUs, at most one per piece). 0 writes the pieces in this process,
+     between the chunks.
+    :type processes: int or None
+    :param chords: See generate_batch().
+    :type chords: ChordVocabulary or None
+    :param note_decoding: See postprocess_stream().
+    :type note_decoding: (int or None, int or None, int) or None
+    :param volume_starts: See write_pieces().
+    :type volume_starts: list of int or None
+    :returns: None
+    """
+    if volume_starts is None:
+        volume_starts = [0] * len(file_paths)
+    if note_decoding is not None:
+        # Checks the thresholds before starting the writers.
+        NoteDecoder(*note_decoding)
+    chunks = generate_batch(model, primes, nb_steps, temperatures, boolean,
+                            seeds=seeds, chords=chords)
+    postprocess_args = (columns_present, volume_avg, row_compression,
+                        note_decoding)
+
+    if processes == 0:
+        write_pieces(chunks, file_paths, meta_info, postprocess_args,
+                     volume_starts)
+        return
+
+    # Every writer process writes a contiguous group of pieces.
+    nb_writers = min(len(file_paths), processes or cpu_count())
+    groups = np.array_split(np.arange(len(file_paths)), nb_writers)
+    queues = [Queue(max_queued_chunks) for _ in groups]
+    writers = [Process(target=write_queued_pieces, args=(
+        queue, [file_paths[idx] for idx in group], meta_info,
+        postprocess_args, [volume_starts[idx] for idx in group]))
+        for queue, group in zip(queues, groups)]
+    for writer in writers:
+        writer.start()
+
+    try:
+        while True:
+            with span('generate_chunk') as chunk_span:
+                chunk = next(chunks, None)
+                chunk_span.set(chunk=chunk)
+            if chunk is None:
+                break
+            for queue, group, writer in zip(queues, groups, writers):
+                put_chunk(queue, chunk[group[0]: group[-1] + 1], writer)
+        for queue, writer in zip(queues, writers):
+            put_chunk(queue, None, writer)
+    except BaseException:
+        for writer in writers:
+            writer.terminate()
+        raise
+
+    with span('write_outputs'):
+        for writer in writers:
+            writer.join()
+            if writer.exitcode:
+                raise RuntimeError('A writer process exited with code ' +
+                                   str(writer.exitcode))
+
+
+def ticks_per_minute(resolution, tempo_event=None):
+    """
+    Computes the number of ticks in a minute of music.
+    :param resolution: The number of ticks per beat.
+    :type resolution: int
+    :param tempo_event: The tempo (120 bpm if None).
+    :type tempo_event: SetTempoEvent or None
+    :returns: The number of ticks.
+    :return_type: float
+    """
+    bpm = tempo_event.get_bpm() if tempo_event else 120.
+    return resolution * bpm
+
+
+def output_file_paths(nb_outputs, out_dir='output'):
+    """
+    Names the output midi files after the current time.
+    :param nb_outputs: The number of output files.
+    :type nb_outputs: int
+    :param out_dir: The directory of the output files.
+    :type out_dir: str
+    :returns: The paths of the output files.
+    :return_type: list
+    """
+    timestamp = str(datetime.datetime.now())
+    timestamp = timestamp.replace(' ', '_').replace(':', '_')
+    out_file_prefix = os.path.join(out_dir, timestamp)
+    if nb_outputs == 1:
+        return [out_file_prefix + '.mid']
+    return [out_file_prefix + '_' + str(idx) + '.mid'
+            for idx in xrange(nb_outputs)]
+
+
+def postprocess_settings(model_meta):
+    """
+    Finds how the generated ticks must be post-processed, from the
+    preprocessing meta-data the model was trained with.
+    :param model_meta: The meta-data of the model.
+    :type model_meta: dict
+    :returns: The arguments of postprocess_stream() (after the chunks).
+    :return_type: (list or None, int or 2-D numpy array or None,
+     (int, str) or None)
+    """
+    columns_present = model_meta['columns_present']
+    if len(columns_present) == 128:
+        columns_present = None
+    volume_avg = None
+    if model_meta['boolean']:
+        # Models trained before velocity tables only have the average.
+        volume_avg = model_meta['volume_avg']
+        if model_meta.get('velocity_table'):
+            volume_avg = np.array(model_meta['velocity_table'],
+                                  dtype=np.uint8)
+    row_compression = None
+    if model_meta['row_compression_batch_size']:
+        row_compression = (model_meta['row_compression_batch_size'],
+                           model_meta['row_compression_strategy'])
+    return columns_present, volume_avg, row_compression
+
+
+@traced
+def load_prime(file_path, model_meta, prime_size, rng=np.random):
+    """
+    Preprocesses a random window of a midi file the same way as the corpus
+    the model was trained on, to start the generation from.
+    :param file_path: The path of the midi file.
+    :type file_path: str
+    :param model_meta: The meta-data of the model.
+    :type model_meta: dict
+    :param prime_size: The number of (compressed) ticks of the window.
+    :type prime_size: int
+    :param rng: The random number generator.
+    :type rng: numpy RandomState
+    :returns: The window (shorter if the song is), and its first row in
+     the song.
+    :return_type: (2-D numpy array, int)
+    """
+    runs, _ = midi_to_sequence_fast(file_path, run_length=True,
+                                    grid=model_meta.get('grid'))
+    if model_meta['row_compression_batch_size']:
+        runs = compress_rows(runs, model_meta['row_compression_batch_size'],
+                             model_meta['row_compression_strategy'])
+    runs = StateRuns(runs.states[:, model_meta['columns_present']],
+                     runs.durations)
+
+    start = rng.randint(max(len(runs) - prime_size, 0) + 1)
+    prime = runs.to_state_matrix(start, start + prime_size)
+    if model_meta['boolean']:
+        np.minimum(prime, 1, out=prime)
+    return prime, start
+
+
+def generate_from_saved_model(nb_outputs=1, nb_minutes=1., prime_path=None,
+                              music_dir='music', temperature=0., seed=None,
+                              out_dir='output', model_dir=model_save_dir,
+                              note_decoding=None):
+    """
+    Generates music with the saved model, using the preprocessing meta-data
+    saved along with it instead of loading the corpus.
+    Every piece starts from a random window of a midi file (silence if there
+    is none).
+    :param nb_outputs: The number of pieces to generate.
+    :type nb_outputs: int
+    :param nb_minutes: The length of every piece.
+    :type nb_minutes: float
+    :param prime_path: The midi file to start from (defaults to a random file
+     of music_dir for each piece).
+    :type prime_path: str or None
+    :param music_dir: The directory containing the midi files.
+    :type music_dir: str
+    :param temperature: See sample_state().
+    :type temperature: float
+    :param seed: The seed of the random number generator.
+    :type seed: int or None
+    :param out_dir: The directory of the output midi files.
+    :type out_dir: str
+    :param model_dir: The directory of the saved model.
+    :type model_dir: str
+    :param note_decoding: See postprocess_stream().
+    :type note_decoding: (int or None, int or None, int) or None
+    :returns: The paths of the output midi files.
+    :return_type: list
+    """
+    if not model_exists(model_dir):
+        raise IOError('No saved model found in "' + model_dir +
+                      '", train one first')
+    model_meta = load_model_meta(model_dir)
+    if model_meta is None or 'boolean' not in model_meta:
+        raise IOError('The model was saved without its preprocessing ' +
+                      'meta-data, train it again to save it')
+    with span('load_model'):
+        model = load_model(model_dir)
+    # Models trained on datapoints of several sizes take any prime size.
+    prime_size = model.input_shape[1] or model_meta['prime_size']
+    nb_columns = model.output_shape[-1]
+    chords = None
+    if model_meta.get('chords'):
+        chords = ChordVocabulary.load(os.path.join(model_dir,
+                                                   model_chords_file))
+
+    rng = np.random.RandomState(seed)
+    if prime_path is not None:
+        prime_paths = [prime_path] * nb_outputs
+    elif os.path.isdir(music_dir) and list_midi_files(music_dir):
+        file_paths = list_midi_files(music_dir)
+        prime_paths = [file_paths[idx] for idx in
+                       rng.randint(len(file_paths), size=nb_outputs)]
+    else:
+        prime_paths = [None] * nb_outputs
+
+    columns_present, volume_avg, row_compression = \
+        postprocess_settings(model_meta)
+    # Every piece continues the velocity cycle of its prime.
+    period = len(volume_avg) if np.ndim(volume_avg) == 2 else 1
+    primes = np.zeros((nb_outputs, prime_size, nb_columns), dtype=STATE_DTYPE)
+    volume_starts = [0] * nb_outputs
+    for idx, file_path in enumerate(prime_paths):
+        if file_path is not None:
+            prime, start = load_prime(file_path, model_meta, prime_size, rng)
+            primes[idx, prime_size - len(prime):] = prime
+            volume_starts[idx] = (start + len(prime)) % period
+
+    meta_info = (model_meta['resolution'],
+                 decode_tempo_event(np.array(model_meta['tempo'])))
+    nb_steps = int(nb_minutes * ticks_per_minute(*meta_info) /
+                   max(model_meta['row_compression_batch_size'], 1))
+    seeds = rng.randint(1 << 31, size=nb_outputs).tolist()
+
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    file_paths = output_file_paths(nb_outputs, out_dir)
+    generate_to_files(model, primes, nb_steps, file_paths, meta_info,
+                      [temperature] * nb_outputs, model_meta['boolean'], seeds,
+                      columns_present, volume_avg, row_compression,
+                      chords=chords, note_decoding=note_decoding,
+                      volume_starts=volume_starts)
+    return file_paths
+
+
+def add_arguments(parser):
+    """
+    Adds the options of the generation to a command-line parser.
+    :param parser: The parser.
+    :type parser: argparse.ArgumentParser
+    :returns: None
+    """
+    parser.add_argument('-n', '--outputs', type=int, default=1,
+                        help='number of pieces to generate')
+    parser.add_argument('-m', '--minutes', type=float, default=1.,
+                        help='length of every piece')
+    parser.add_argument('-p', '--prime',
+                        help='midi file to start from (defaults to a random '
+                        'file of the music directory)')
+    parser.add_argument('--music-dir', default='music',
+                        help='directory of the midi files to start from')
+    parser.add_argument('-t', '--temperature', type=float, default=0.,
+                        help='amount of noise added to the predictions')
+    parser.add_argument('-s', '--seed', type=int,
+                        help='seed of the random number generator')
+    parser.add_argument('-o', '--output-dir', default='output',
+                        help='directory of the output midi files')
+    parser.add_argument('--model-dir', default=model_save_dir,
+                        help='directory of the saved model')
+    parser.add_argument('--on-threshold', type=int, metavar='VOLUME',
+                        help='volume turning a generated note ON (no '
+                        'thresholding by default)')
+    parser.add_argument('--off-threshold', type=int, metavar='VOLUME',
+                        help='volume below which a generated note is turned '
+                        'OFF (defaults to --on-threshold)')
+    parser.add_argument('--min-duration', type=int, default=1, metavar='ROWS',
+                        help='minimum number of rows of a generated note')
+
+
+def check_arguments(parser, args):
+    """
+    Rejects the inconsistent options of the generation.
+    :param parser: The parser the options were parsed with.
+    :type parser: argparse.ArgumentParser
+    :param args: The parsed options (see add_arguments()).
+    :type args: argparse.Namespace
+    :returns: None
+    """
+    if args.off_threshold is not None and args.on_threshold is None:
+        parser.error('--off-threshold requires --on-threshold')
+
+
+def run(args):
+    """
+    Generates music as requested on the command-line.
+    :param args: The parsed options (see add_arguments()).
+    :type args: argparse.Namespace
+    :returns: None
+    """
+    note_decoding = None
+    if args.on_threshold is not None or args.min_duration > 1:
+        note_decoding = (args.on_threshold, args.off_threshold,
+                         args.min_duration)
+    print 'Generating ...\n'
+    out_file_paths = generate_from_saved_model(
+        args.outputs, args.minutes, args.prime, args.music_dir,
+        args.temperature, args.seed, args.output_dir, args.model_dir,
+        note_decoding)
+    print 'Generating done!\n'
+    for out_file_path in out_file_paths:
+        print 'Output written to "' + out_file_path + '"\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate music with the saved model.')
+    add_arguments(parser)
+    args = parser.parse_args()
+    check_arguments(parser, args)
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,227 +1,450 @@
 #!/usr/bin/env python2
+'''
+Command-line interface of Jukebot.
+Run `./main.py <command> --help` for the options of each command.
+Keras is only imported by the commands which need it.
+'''
+import argparse
 import os
-from pprint import pprint
-import cPickle as pickle
-import datetime
-import errno
-
-
-import numpy as np
-from keras.models import Sequential, model_from_json
-from keras.layers.recurrent import LSTM
-from keras.layers.core import Dense, Dropout
-from keras.regularizers import l2
-
-
-from midi_lib.midi_sequence import midi_to_sequence, sequence_to_midi
-from midi_lib.midi_volume import insert_volume_into_state_matrix, remove_volume_from_state_matrix
-from midi_lib.midi_compress import compress_state_matrix, decompress_state_matrix
-
-
-def load_data():
+import sys
+
+import bench
+import generate
+from chords import ChordVocabulary
+from corpus import build_corpus, corpus_is_current, open_corpus, \
+    get_corpus_dir, read_corpus_index
+from dataset import bucket_batch_generator, song_windows, split_buckets, \
+    transposition_sources
+from midi_lib import midi_trace
+from midi_lib.midi_compress import row_compression_strategies
+from midi_lib.midi_trace import span
+from model_io import load_model_meta, mkdir_p, model_chords_file, \
+    model_exists, model_save_dir, save_model, save_model_meta
+
+
+def load_data(settings, corpus_dir=None):
     """
-    Loads midi files and outputs the concatenated state-matrix.
-    :returns: The state-matrix
-    :return_type: 2-D list
+    Loads the preprocessed corpus, first (re)building it from the midi files
+    if it is missing or was built with different settings.
+    :param settings: The preprocessing settings (see build_corpus()).
+    :type settings: dict
+    :param corpus_dir: The directory of the preprocessed corpus (defaults
+     to the one of the settings, see get_corpus_dir()).
+    :type corpus_dir: str or None
+    :returns: The (memory-mapped) state-matrix and the index of the corpus.
+    :return_type: (2-D numpy memmap, dict)
     """
-    state_matrix = []
-    for subdir, dirs, files in os.walk('music'):
-        for file in files:
-            print 'Loading "' + file + '" ...\n'
-            file_path = os.path.join(subdir, file)
-            state_matrix.extend(midi_to_sequence(file_path)[0])
-            print 'Done!\n'
-    return state_matrix
-
-
-def preprocess_data(state_matrix, prime_size):
+    if corpus_dir is None:
+        corpus_dir = get_corpus_dir(settings)
+    with span('load_data') as load_span:
+        if not corpus_is_current(read_corpus_index(corpus_dir), settings):
+            print 'Preprocessing corpus ...\n'
+            build_corpus(corpus_dir=corpus_dir, **settings)
+            print 'Preprocessing corpus done!\n'
+        state_matrix, index = open_corpus(corpus_dir)
+        load_span.set(state_matrix=state_matrix)
+    return state_matrix, index
+
+
+def preprocess_data(corpus_index, window_sizes, step_size=1):
     """
-    Processes the 2-D state-matrix to produce a 3-D version 'X'
-    of dimensions = len(state_matrix) * prime_size * len(state_matrix[0]).
-    Each 2-D row 'X[i]' becomes a separate datapoint.
+    Cuts the songs of the corpus into datapoints: windows of consecutive
+    rows of the state-matrix, each followed by its target row.
     X[i][tick][pitch] = volume
-    Corresponding to each datapoint X[i], a target value Y[i] is also computed.
-    :param state_matrix: The state-matrix.
-    :type state_matrix: 2-D list
-    :param prime_size: The size of a single datapoint
-    :type prime_size: int
-    :returns: A list of datapoints and the corresponding target output values.
-    :return_type: (3-D list, 2-D list)
+    The windows never straddle two songs, and are bucketed by size (see
+    song_windows()). Only their first row is stored; they are copied out of
+    the state-matrix one batch at a time.
+    :param corpus_index: The index of the corpus.
+    :type corpus_index: dict
+    :param window_sizes: The allowed sizes of a datapoint.
+    :type window_sizes: list of int
+    :param step_size: The number of rows between consecutive datapoints.
+    :type step_size: int
+    :returns: The first row of every datapoint, for every size.
+    :return_type: dict of int to 1-D numpy array
     """
-    X = []
-    Y = []
-
-    # Skip (step_size - 1) rows while forming the input dataset to save memory.
-    step_size = 1
-
-    for i in xrange(0, len(state_matrix) - prime_size, step_size):
-        data_point_x = state_matrix[i: i + prime_size]
-        X.append(data_point_x)
-
-        data_point_y = state_matrix[i + prime_size]
-        Y.append(data_point_y)
-
-    return X, Y
+    songs = [(song['offset'], song['length'])
+             for song in corpus_index['songs']]
+    return song_windows(songs, window_sizes, step_size)
 
 
-# Location for saving (serializing) the model.
-model_save_dir = os.path.join('models', 'model_save')
-model_arch_path = os.path.join(model_save_dir, 'arch.json')
-model_weights_path = os.path.join(model_save_dir, 'weights.h5')
-model_history_path = os.path.join(model_save_dir, 'hist.p')
-
-
-def save_model(model):
+def build_model(prime_size, nb_columns, min_nodes=128,
+                vocabulary_size=None, embedding_dim=64):
     """
-    Saves (serializes) the model.
-    Mostly adapted from Keras documentation.
-    :param model: The model to save.
-    :type model: Keras model type
-    :returns: None.
+    Builds the (untrained) model.
+    :param prime_size: The number of ticks of a datapoint (None for
+     datapoints of any length).
+    :type prime_size: int or None
+    :param nb_columns: The number of pitches of a tick.
+    :type nb_columns: int
+    :param min_nodes: The minimum number of nodes of the first LSTM layer.
+    :type min_nodes: int
+    :param vocabulary_size: The number of chord indices, if the ticks are
+     fed as chord indices (see ChordVocabulary) instead of pitch vectors.
+    :type vocabulary_size: int or None
+    :param embedding_dim: The size of the vectors the chords are embedded as.
+    :type embedding_dim: int
+    :returns: The model.
+    :return_type: Keras Sequential model
     """
-    def mkdir_p(path):
-        """
-        Create all the intermediate directories in a path.
-        Similar to the `mkdir -p` command.
-        """
-        try:
-            os.makedirs(path)
-        except OSError as exc:  # Python >2.5
-            if exc.errno == errno.EEXIST and os.path.isdir(path):
-                pass
-            else:
-                raise
-
-    # Ensure that the directory exists!
-    mkdir_p(model_save_dir)
-
-    json_string = model.to_json()
+    from keras.models import Sequential
+    from keras.layers.embeddings import Embedding
+    from keras.layers.recurrent import LSTM
+    from keras.layers.core import Dense, Dropout
+
+    nb_nodes = max(nb_columns, min_nodes)
+
+    model = Sequential()
+    print 'Adding layer 1 ...\n'
+    if vocabulary_size:
+        model.add(Embedding(vocabulary_size, embedding_dim,
+                            input_length=prime_size))
+        model.add(LSTM(nb_nodes, return_sequences=True))
+    else:
+        model.add(LSTM(nb_nodes, input_shape=(
+            prime_size, nb_columns), return_sequences=True))
+    model.add(Dropout(0.2))
+    print 'Adding layer 2 ...\n'
+    model.add(LSTM(nb_nodes * 2))
+    model.add(Dropout(0.2))
+    print 'Adding layer 3 ...\n'
+    model.add(Dense(nb_columns))
+    model.add(Dropout(0.2))
 
-    open(model_arch_path, 'w').write(json_string)
-    model.save_weights(model_weights_path)
+    return model
 
 
-def load_model():
+def preprocessing_settings(args):
     """
-    Loads (deserializes) the model.
-    Mostly adapted from Keras documentation.
-    :returns: None.
-    :return_type: Keras model type
+    Collects the preprocessing settings given on the command-line.
+    :param args: The parsed options.
+    :type args: argparse.Namespace
+    :returns: The keyword arguments of build_corpus().
+    :return_type: dict
     """
-    model = model_from_json(open(model_arch_path).read())
-    model.load_weights(model_weights_path)
-    return model
+    return {
+        'music_dir': args.music_dir,
+        'row_compression_batch_size': args.row_compression,
+        'row_compression_strategy': args.row_strategy,
+        'column_compression': args.column_compression,
+        'boolean': args.boolean,
+        'velocity_period': args.velocity_period,
+        'pack': args.pack,
+        'grid': args.grid,
+    }
+
+
+def preprocess(args):
+    """
+    The `preprocess` command: builds the preprocessed corpus (if it is not
+    up to date already).
+    """
+    print 'Row-compression ratio = ', args.row_compression
+    _, corpus_index = load_data(preprocessing_settings(args), args.corpus_dir)
+    print len(corpus_index['songs']), 'songs,', \
+        len(corpus_index['columns_present']), 'pitches'
+    if args.boolean:
+        print 'Average volume = ', corpus_index['volume_avg'], '\n\n'
 
 
-def main():
-    boolean_on = False
-    compression_on = True
+def train(args):
+    """
+    The `train` command: trains a model on the preprocessed corpus and
+    saves it along with the preprocessing meta-data.
+    The model is checkpointed during the training; if the training was
+    interrupted (or more epochs are requested), it resumes from the latest
+    checkpoint. The saved model is the best checkpoint (lowest validation
+    loss).
+    """
+    from checkpoint import TrainingCheckpoint, best_checkpoint_file, \
+        get_checkpoint_dir, load_checkpoint, read_checkpoint_state, \
+        remove_checkpoints
+
+    checkpoint_state = read_checkpoint_state(args.model_dir)
+    if args.force:
+        remove_checkpoints(args.model_dir)
+        checkpoint_state = None
+    elif checkpoint_state is None and model_exists(args.model_dir):
+        sys.exit('A model is already saved in "' + args.model_dir +
+                 '", use --force to train a new one over it')
+
+    # Checked before the corpus is (re)built with the new settings.
+    settings = preprocessing_settings(args)
+    if checkpoint_state is not None and \
+            (load_model_meta(args.model_dir) or {}).get('settings') != \
+            settings:
+        sys.exit('The checkpoints in "' + args.model_dir + '" were trained '
+                 'with other preprocessing settings, use --force to train '
+                 'a new model over them')
 
     print 'Loading data ...\n'
-    state_matrix = load_data()
+    print 'Row-compression ratio = ', args.row_compression
+    state_matrix, corpus_index = load_data(settings, args.corpus_dir)
     print 'Loading data done!\n'
-    # print len(state_matrix)
-
-    if compression_on:
-        print 'Compressing ...\n'
-        row_comp_ratio = 10
-        print 'Row-compression ratio = ', row_comp_ratio
-        state_matrix, columns_present = compress_state_matrix(
-            state_matrix, row_comp_ratio)
-        print 'Compressing done!\n'
-
-    if boolean_on:
-        print 'Converting to boolean ...\n'
-        volume_avg = remove_volume_from_state_matrix(state_matrix)
-        print 'Converting to boolean done!\n'
-        print 'Average volume = ', volume_avg, '\n\n'
-
-    prime_size = 50
+    if args.boolean:
+        print 'Average volume = ', corpus_index['volume_avg'], '\n\n'
+
+    # A single window size gives a model with a fixed input length.
+    window_sizes = sorted(set(args.buckets or [args.prime_size]))
+    prime_size = window_sizes[0] if len(window_sizes) == 1 else None
+
+    # The output resolution/tempo is (100, 120 bpm), or (grid, 120 bpm) for
+    # quantized songs.
+    model_meta = {
+        'columns_present': corpus_index['columns_present'],
+        'row_compression_batch_size': args.row_compression,
+        'row_compression_strategy': args.row_strategy,
+        'boolean': args.boolean,
+        'volume_avg': corpus_index['volume_avg'],
+        'velocity_table': corpus_index['velocity_table'],
+        'resolution': args.grid or 100,
+        'tempo': [],
+        'grid': args.grid,
+        'prime_size': window_sizes[-1],
+        'chords': args.chords,
+        'settings': settings,
+    }
+    if checkpoint_state is not None and \
+            load_model_meta(args.model_dir) != model_meta:
+        sys.exit('The checkpoints in "' + args.model_dir + '" were trained '
+                 'on another corpus or with other settings, use --force to '
+                 'train a new model over them')
+
     print 'Preprocessing data ...\n'
-    X, Y = preprocess_data(state_matrix, prime_size)
+    with span('preprocess_data'):
+        buckets = preprocess_data(corpus_index, window_sizes)
     print 'Preprocessing data done!\n'
 
-    print 'Casting to numpy-array ...\n'
-    if boolean_on:
-        X, Y = np.array(X, dtype=bool), np.array(Y, dtype=bool)
-    else:
-        X, Y = np.array(X), np.array(Y)
-    print 'Casting to numpy-array done!\n'
-
-    print X.shape, Y.shape, '\n'
-
-    if os.path.exists(model_save_dir):
-        print 'Loading model ...\n'
-        model = load_model()
-        print 'Loading model done!\n'
+    for window_size in window_sizes:
+        print len(buckets[window_size]), 'windows of', window_size, 'ticks'
+    print
+    nb_columns = len(corpus_index['columns_present'])
+    # The number of pitches of a packed row, for the batch generators.
+    packed_columns = nb_columns if args.pack else None
+
+    chords = None
+    chord_inputs = None
+    if args.chords:
+        chords_path = os.path.join(args.model_dir, model_chords_file)
+        with span('chord_vocabulary'):
+            if checkpoint_state is not None:
+                chords = ChordVocabulary.load(chords_path)
+            else:
+                chords = ChordVocabulary.from_state_matrix(
+                    state_matrix, args.chords - 1, nb_columns=packed_columns)
+                mkdir_p(args.model_dir)
+                chords.save(chords_path)
+            chord_inputs = chords.encode(state_matrix, packed=args.pack)
+        print len(chords), 'chord indices,', \
+            (chord_inputs > 0).mean() * 100, '% of the ticks known\n'
+    input_shape = (prime_size,) if chords else (prime_size, nb_columns)
+
+    # With a checkpoint period above 1, a best checkpoint can be written
+    # before the first periodic one: the training then starts over from
+    # epoch 0, still keeping the best loss to beat.
+    if checkpoint_state is not None and checkpoint_state['epoch'] >= 0:
+        initial_epoch = checkpoint_state['epoch'] + 1
+        print 'Resuming from epoch', initial_epoch, '...\n'
+        with span('load_checkpoint'):
+            model = load_checkpoint(args.model_dir)
+        if model.input_shape[1:] != input_shape:
+            sys.exit('The checkpointed model takes datapoints of shape ' +
+                     str(model.input_shape[1:]) + ', use --force to train '
+                     'a new model')
     else:
+        initial_epoch = 0
         print 'Building model ...\n'
-
-        min_nodes = 128
-        nb_nodes = max(X.shape[2], min_nodes)
-
-        model = Sequential()
-        print 'Adding layer 1 ...\n'
-        model.add(LSTM(nb_nodes, input_shape=(
-            X.shape[1], X.shape[2]), return_sequences=True))
-        model.add(Dropout(0.2))
-        print 'Adding layer 2 ...\n'
-        model.add(LSTM(nb_nodes * 2))
-        model.add(Dropout(0.2))
-        print 'Adding layer 3 ...\n'
-        model.add(Dense(X.shape[2]))
-        model.add(Dropout(0.2))
-
+        with span('build_model'):
+            model = build_model(prime_size, nb_columns, args.min_nodes,
+                                chords and len(chords), args.embedding_dim)
         print 'Building model done!\n'
 
-    print 'Compiling model ...\n'
-    model.compile(loss='mean_squared_error',
-                  optimizer="rmsprop", metrics=['accuracy'])
-    print 'Compiling model done!\n'
-
-    if not os.path.exists(model_save_dir):
-        print 'Training model ...\n'
-        history = model.fit(X, Y, validation_split=0.2)
-        print 'Training model done!\n'
-        # pickle.dump(history, open(model_history_path, 'wb'))
-
-        print 'Saving model ...\n'
-        save_model(model)
-        print 'Saving model done!\n'
-
-    print 'Predicting ...\n'
-    predictions = model.predict(X, batch_size=32, verbose=1)
-    print 'Predicting done!\n'
-    print predictions.shape
-
-    print 'Post-processing predictions ...\n'
-
-    if boolean_on:
-        predictions = np.around(predictions).astype(int).clip(min=0)
-    else:
-        predictions = predictions.astype(int).clip(min=0)
-
-    # Converting back to python-list from numpy-array
-    predictions = predictions.tolist()
-
-    if boolean_on:
-        print 'Converting from boolean ...\n'
-        insert_volume_into_state_matrix(predictions, volume_avg)
-        print 'Converting from boolean done!\n'
-
-    if compression_on:
-        print 'Decompressing ...\n'
-        predictions = decompress_state_matrix(predictions, columns_present)
-        print 'Decompressing done!\n'
+        print 'Compiling model ...\n'
+        with span('compile_model'):
+            model.compile(loss='mean_squared_error',
+                          optimizer="rmsprop", metrics=['accuracy'])
+        print 'Compiling model done!\n'
+        save_model_meta(model_meta, args.model_dir)
+
+    # The training windows are augmented on the fly, batch by batch.
+    transpositions = None
+    if args.transpose:
+        transpositions = transposition_sources(
+            corpus_index['columns_present'], args.transpose)
+    songs = [(song['offset'], song['length'])
+             for song in corpus_index['songs']]
+
+    print 'Training model ...\n'
+    # Batches are copied out of the (strided) dataset one at a time.
+    train_buckets, val_buckets = split_buckets(buckets, args.validation_split)
+    nb_train = sum(len(starts) for starts in train_buckets.itervalues())
+    nb_val = sum(len(starts) for starts in val_buckets.itervalues())
+    validation_data = None
+    if nb_val:
+        validation_data = bucket_batch_generator(
+            state_matrix, val_buckets, args.batch_size, shuffle=False,
+            inputs=chord_inputs, nb_columns=packed_columns)
+    checkpoint = TrainingCheckpoint(
+        args.model_dir, args.checkpoint_period,
+        'val_loss' if nb_val else 'loss', checkpoint_state)
+    with span('fit', epochs=args.epochs, batch_size=args.batch_size):
+        model.fit_generator(
+            bucket_batch_generator(
+                state_matrix, train_buckets, args.batch_size,
+                inputs=chord_inputs, nb_columns=packed_columns,
+                transpositions=transpositions,
+                max_stretch=args.stretch if args.stretch > 1 else None,
+                songs=songs),
+            samples_per_epoch=nb_train, nb_epoch=args.epochs,
+            validation_data=validation_data, nb_val_samples=nb_val,
+            callbacks=[checkpoint], initial_epoch=initial_epoch)
+    print 'Training model done!\n'
+
+    print 'Saving model ...\n'
+    best_checkpoint_path = os.path.join(get_checkpoint_dir(args.model_dir),
+                                        best_checkpoint_file)
+    if os.path.exists(best_checkpoint_path):
+        print 'Best epoch:', checkpoint.state['best_epoch'], '\n'
+        model.load_weights(best_checkpoint_path)
+    with span('save_model'):
+        save_model(model, args.model_dir)
+    print 'Saving model done!\n'
+
+
+def add_preprocessing_arguments(parser):
+    """
+    Adds the preprocessing options to a command-line parser.
+    :param parser: The parser.
+    :type parser: argparse.ArgumentParser
+    :returns: None
+    """
+    parser.add_argument('--music-dir', default='music',
+                        help='directory of the midi files')
+    parser.add_argument('--corpus-dir',
+                        help='directory of the preprocessed corpus (defaults '
+                        'to a sub-directory of preprocessed/ per set of '
+                        'preprocessing settings)')
+    parser.add_argument('--grid', type=int, metavar='ROWS',
+                        help='quantize the notes to ROWS rows per beat '
+                        '(e.g. 4 for 16th notes), whatever the resolution '
+                        'and tempo of each file')
+    parser.add_argument('--row-compression', type=int, metavar='RATIO',
+                        help='number of ticks merged into one (0 disables '
+                        'row-compression); defaults to 10, or 0 with --grid')
+    parser.add_argument('--row-strategy', default='mean',
+                        choices=sorted(row_compression_strategies),
+                        help='how the merged ticks are combined')
+    parser.add_argument('--no-column-compression', dest='column_compression',
+                        action='store_false',
+                        help='keep the pitches which are never played')
+    parser.add_argument('--boolean', action='store_true',
+                        help='discard the volume of the notes (the output '
+                        'gets the average volume of each pitch instead)')
+    parser.add_argument('--velocity-period', type=int, default=1,
+                        metavar='ROWS',
+                        help='with --boolean, average the volume of each '
+                        'pitch separately at each position of a cycle of '
+                        'ROWS rows (e.g. the rows of a bar with --grid)')
+    parser.add_argument('--pack', action='store_true',
+                        help='with --boolean, store the corpus bit-packed '
+                        '(8 pitches per byte); batches are unpacked as they '
+                        'are fed to the model')
 
-    print 'Post-processing predictions done!\n'
 
-    print 'Writing to output file ...\n'
-    out_file_path = 'output/' + \
-        str(datetime.datetime.now()).replace(
-            ' ', '_').replace(':', '_') + '.mid'
-    sequence_to_midi(predictions, out_file_path, (100, None))
-    print 'Writing to output file done!\n'
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generating artificial music using Recurrent Neural '
+        'Networks.')
+    parser.add_argument('--trace', metavar='JSON',
+                        help='time every stage, print a summary at the end '
+                        'and write the trace to a file')
+    subparsers = parser.add_subparsers(title='commands')
+
+    preprocess_parser = subparsers.add_parser(
+        'preprocess', help='preprocess the midi files')
+    add_preprocessing_arguments(preprocess_parser)
+    preprocess_parser.set_defaults(command=preprocess)
+
+    train_parser = subparsers.add_parser(
+        'train', help='train a model (or resume its training)')
+    add_preprocessing_arguments(train_parser)
+    train_parser.add_argument('--model-dir', default=model_save_dir,
+                              help='directory to save the model to')
+    train_parser.add_argument('--force', action='store_true',
+                              help='train a new model over an already saved '
+                              'one (and its checkpoints)')
+    train_parser.add_argument('--checkpoint-period', type=int, default=1,
+                              metavar='EPOCHS',
+                              help='number of epochs between checkpoints')
+    train_parser.add_argument('--prime-size', type=int, default=50,
+                              help='number of ticks of a datapoint')
+    train_parser.add_argument('--buckets', type=int, nargs='+',
+                              metavar='SIZE',
+                              help='train on datapoints of several sizes '
+                              '(instead of --prime-size); each song is cut '
+                              'into datapoints of the largest size it can '
+                              'hold')
+    train_parser.add_argument('--min-nodes', type=int, default=128,
+                              help='minimum number of nodes of the first '
+                              'layer')
+    train_parser.add_argument('--chords', type=int, default=0, metavar='N',
+                              help='feed the ticks to the model as the '
+                              'indices of their chords, out of the N - 1 '
+                              'most frequent ones (0 feeds every pitch)')
+    train_parser.add_argument('--embedding-dim', type=int, default=64,
+                              help='size of the vectors the chords are '
+                              'embedded as (with --chords)')
+    train_parser.add_argument('--transpose', type=int, default=0,
+                              metavar='SEMITONES',
+                              help='transpose every training datapoint by a '
+                              'random number of semitones, up to SEMITONES '
+                              'up or down')
+    train_parser.add_argument('--stretch', type=float, default=1.,
+                              metavar='FACTOR',
+                              help='slow down or speed up every training '
+                              'datapoint by a random factor, up to FACTOR')
+    train_parser.add_argument('--epochs', type=int, default=10,
+                              help='total number of epochs (including the '
+                              'ones already trained, when resuming)')
+    train_parser.add_argument('--batch-size', type=int, default=32,
+                              help='number of datapoints per batch')
+    train_parser.add_argument('--validation-split', type=float, default=0.2,
+                              help='fraction of the corpus (at the end) '
+                              'kept for validation')
+    train_parser.set_defaults(command=train)
+
+    generate_parser = subparsers.add_parser(
+        'generate', help='generate music with a saved model')
+    generate.add_arguments(generate_parser)
+    generate_parser.set_defaults(command=generate.run)
+
+    benchmark_parser = subparsers.add_parser(
+        'benchmark', help='measure the speed and memory of the midi '
+        'encoding/decoding and preprocessing')
+    bench.add_arguments(benchmark_parser)
+    benchmark_parser.set_defaults(command=bench.run)
+
+    args = parser.parse_args()
+    if getattr(args, 'pack', False) and not args.boolean:
+        parser.error('--pack requires --boolean')
+    if getattr(args, 'transpose', 0) and args.chords:
+        parser.error('--transpose cannot be used with --chords')
+    if getattr(args, 'stretch', 1.) < 1:
+        parser.error('--stretch must be at least 1')
+    if args.command is generate.run:
+        generate.check_arguments(parser, args)
+    if getattr(args, 'row_compression', 0) is None:
+        # Quantized songs are short enough already.
+        args.row_compression = 0 if args.grid else 10
+    if args.trace:
+        midi_trace.enable()
+    args.command(args)
+
+    if args.trace:
+        print
+        midi_trace.print_summary()
+        midi_trace.write_trace(args.trace)
+        print '\nTrace written to "' + args.trace + '"'
 
 
 if __name__ == '__main__':
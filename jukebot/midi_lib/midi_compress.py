@@ -2,106 +2,271 @@
 '''
 Compress state matrix and back.
 '''
+import numpy as np
+
 from midi_debug import *
 from midi_sequence import *
+from midi_runs import StateRuns, concatenate_runs
+from midi_state import STATE_DTYPE, as_state_matrix, new_state_matrix
+from midi_trace import traced
+
+
+# The number of batches expanded at a time when compressing the rows of a
+# run-length encoded state-matrix.
+stream_chunk_batches = 4096
+
+
+def average_batches(batches, previous_row):
+    """
+    Row-compression strategy: every batch of rows is replaced by its
+    (integer) average.
+    :param batches: The batches of rows.
+    :type batches: 3-D numpy array
+    :param previous_row: The row preceding the first batch.
+    :type previous_row: 1-D numpy array
+    :returns: One row per batch.
+    :return_type: 2-D numpy array
+    """
+    return batches.sum(axis=1, dtype=np.uint32) // batches.shape[1]
+
+
+def max_pool_batches(batches, previous_row):
+    """
+    Row-compression strategy: every batch of rows is replaced by the loudest
+    volume of each pitch in it, so that short notes are never dropped.
+    :param batches: The batches of rows.
+    :type batches: 3-D numpy array
+    :param previous_row: The row preceding the first batch.
+    :type previous_row: 1-D numpy array
+    :returns: One row per batch.
+    :return_type: 2-D numpy array
+    """
+    return batches.max(axis=1)
+
+
+def onset_batches(batches, previous_row):
+    """
+    Row-compression strategy: every batch of rows is replaced by its first
+    row, along with the notes turned ON anywhere in the batch (at their
+    initial volume), so that sustained notes keep their volume and short
+    notes are not dropped.
+    :param batches: The batches of rows.
+    :type batches: 3-D numpy array
+    :param previous_row: The row preceding the first batch.
+    :type previous_row: 1-D numpy array
+    :returns: One row per batch.
+    :return_type: 2-D numpy array
+    """
+    rows = batches.reshape(-1, batches.shape[2])
+    previous_rows = np.empty_like(rows)
+    previous_rows[1:] = rows[:-1]
+    previous_rows[0] = previous_row
+    onsets = np.where(previous_rows == 0, rows, 0).reshape(batches.shape)
+    return np.maximum(batches[:, 0], onsets.max(axis=1))
+
+
+def hold_rows(state_matrix, batch_size):
+    """
+    Row-decompression: every row is repeated batch_size times.
+    Inverse of all the row-compression strategies.
+    :param state_matrix: The compressed state-matrix.
+    :type state_matrix: 2-D numpy array
+    :param batch_size: The number of rows grouped together.
+    :type batch_size: int
+    :returns: The decompressed state-matrix.
+    :return_type: 2-D numpy array
+    """
+    return np.repeat(state_matrix, batch_size, axis=0)
 
 
-def compress_rows(state_matrix, batch_size):
+# The row-compression strategies, each with its row-decompression.
+row_compression_strategies = {
+    'mean': (average_batches, hold_rows),
+    'max': (max_pool_batches, hold_rows),
+    'onset': (onset_batches, hold_rows),
+}
+
+
+def compress_rows_stream(chunks, batch_size, strategy='mean'):
+    """
+    Compress a state-matrix given as consecutive chunks of rows,
+    using row-based compression scheme.
+    The chunks can have any length; the last batch may be partial.
+    :param chunks: The consecutive chunks of the state-matrix.
+    :type chunks: iterable of 2-D numpy array
+    :param batch_size: The number of rows to group together.
+    :type batch_size: int
+    :param strategy: The row-compression strategy
+     (see row_compression_strategies).
+    :type strategy: str
+    :returns: The compressed state-matrix, chunk by chunk.
+    :return_type: generator of 2-D numpy array
+    """
+    compress_batches = row_compression_strategies[strategy][0]
+
+    leftover = None
+    previous_row = None
+    for chunk in chunks:
+        chunk = as_state_matrix(chunk)
+        if previous_row is None:
+            previous_row = np.zeros(chunk.shape[1], dtype=chunk.dtype)
+        if leftover is not None and len(leftover):
+            chunk = np.concatenate((leftover, chunk))
+
+        nb_full_batches = len(chunk) // batch_size
+        full_rows = nb_full_batches * batch_size
+        if nb_full_batches:
+            batches = chunk[:full_rows].reshape(
+                nb_full_batches, batch_size, chunk.shape[1])
+            yield compress_batches(batches, previous_row).astype(STATE_DTYPE)
+            previous_row = chunk[full_rows - 1]
+        leftover = chunk[full_rows:]
+
+    # The last (partial) batch is compressed over its own length.
+    if leftover is not None and len(leftover):
+        yield compress_batches(
+            leftover[np.newaxis], previous_row).astype(STATE_DTYPE)
+
+
+@traced
+def compress_rows(state_matrix, batch_size, strategy='mean'):
     """
     Compress the state-matrix using row-based compression scheme.
+    Every batch of rows is replaced by a single row, computed according to
+    the strategy.
     :param state_matrix: The state-matrix.
-    :type state_matrix: 2-D list
+    :type state_matrix: 2-D numpy array or StateRuns
     :param batch_size: The number of rows to group together.
     :type batch_size: int
-    :returns: The compressed state-matrix.
-    :return_type: 2-D list
+    :param strategy: The row-compression strategy
+     (see row_compression_strategies).
+    :type strategy: str
+    :returns: The compressed state-matrix (run-length encoded if the input is).
+    :return_type: 2-D numpy array or StateRuns
     """
-    def compute_batch_average(state_matrix, start_idx, end_idx):
-        """
-        Compress state_matrix[start_idx: end_idx] using
-        row-based compression scheme.
-        :param state_matrix: The state-matrix.
-        :type state_matrix: 2-D list
-        :returns: The average of state_matrix[start_idx: end_idx]
-        :return_type: 1-D list
-        """
-        ret = [0] * len(state_matrix[0])
-
-        for i in xrange(start_idx, end_idx):
-            for j in xrange(len(ret)):
-                ret[j] += state_matrix[i][j]
+    if isinstance(state_matrix, StateRuns):
+        if strategy == 'mean':
+            return compress_runs(state_matrix, batch_size)
+        # Expanded a few batches at a time.
+        chunks = compress_rows_stream(state_matrix.iter_chunks(
+            batch_size * stream_chunk_batches), batch_size, strategy)
+        return concatenate_runs([StateRuns.from_state_matrix(chunk)
+                                 for chunk in chunks],
+                                state_matrix.nb_columns)
+
+    state_matrix = as_state_matrix(state_matrix)
+    chunks = list(compress_rows_stream([state_matrix], batch_size, strategy))
+    if not chunks:
+        return new_state_matrix(0, state_matrix.shape[1])
+    return np.concatenate(chunks)
+
+
+@traced
+def decompress_rows(state_matrix, batch_size, strategy='mean'):
+    """
+    Decompress a state-matrix compressed using row-based compression scheme,
+    restoring its original timing.
+    Works on the whole state-matrix as well as on consecutive chunks of it.
+    :param state_matrix: The compressed state-matrix.
+    :type state_matrix: 2-D numpy array
+    :param batch_size: The number of rows grouped together.
+    :type batch_size: int
+    :param strategy: The row-compression strategy used.
+    :type strategy: str
+    :returns: The decompressed state-matrix.
+    :return_type: 2-D numpy array
+    """
+    decompress = row_compression_strategies[strategy][1]
+    return decompress(as_state_matrix(state_matrix), batch_size)
 
-        for i in xrange(len(ret)):
-            ret[i] /= end_idx - start_idx
 
-        return ret
+def compress_runs(runs, batch_size):
+    """
+    Row-based compression of a run-length encoded state-matrix.
+    Only the batches which straddle a change of state need to be averaged;
+    the others simply take the state of the run they lie in.
+    :param runs: The state-matrix.
+    :type runs: StateRuns
+    :param batch_size: The number of rows to group together.
+    :type batch_size: int
+    :returns: The compressed state-matrix.
+    :return_type: StateRuns
+    """
+    nb_rows = len(runs)
+    nb_batches = -(-nb_rows // batch_size)
 
-    ret = []
+    # The compressed rows are grouped into segments of identical batches.
+    # A segment boundary is needed around every batch in which a run starts.
+    batches = runs.starts // batch_size
+    unaligned = batches[runs.starts % batch_size != 0]
+    segment_starts = np.union1d(np.union1d(batches, unaligned + 1), [0])
+    segment_starts = segment_starts[segment_starts < nb_batches]
+    durations = np.diff(np.append(segment_starts, nb_batches))
 
-    for i in xrange(0, len(state_matrix), batch_size):
-        batch_average_row = compute_batch_average(
-            state_matrix, i, min(i + batch_size, len(state_matrix)))
-        ret.append(batch_average_row)
+    # The first batch of each segment is representative of the segment.
+    first_rows = segment_starts * batch_size
+    last_rows = np.minimum(first_rows + batch_size, nb_rows)
+    sums = runs.prefix_sums(last_rows) - runs.prefix_sums(first_rows)
+    states = sums // (last_rows - first_rows)[:, np.newaxis].astype(np.uint64)
 
-    return ret
+    return StateRuns(states, durations)
 
 
 def transpose(grid):
     """
     Return the transpose of a matrix.
     """
-    return map(list, zip(*grid))
+    return np.asarray(grid).T
 
 
+@traced
 def compress_state_matrix(state_matrix, row_compression_batch_size=0):
     """
     Compress the state-matrix using row and column based compression schemes.
     :param state_matrix: The state-matrix.
-    :type state_matrix: 2-D list
+    :type state_matrix: 2-D numpy array or StateRuns
     :param row_compression_batch_size: The number of rows to group together.
     :type row_compression_batch_size: int
-    :returns: The compressed state-matrix and the list of column indices
-     remaining after column-compression.
-    :return_type: (2-D list, 1-D list)
+    :returns: The compressed state-matrix (run-length encoded if the input is)
+     and the column indices remaining after column-compression.
+    :return_type: (2-D numpy array or StateRuns, 1-D numpy array)
     """
-    ret = []
-    columns_present = []
-
     if row_compression_batch_size:
         state_matrix = compress_rows(state_matrix, row_compression_batch_size)
 
-    state_matrix_transposed = transpose(state_matrix)
+    if isinstance(state_matrix, StateRuns):
+        states, columns_present = compress_state_matrix(state_matrix.states)
+        return StateRuns(states, state_matrix.durations), columns_present
 
-    for idx, pitch_column in enumerate(state_matrix_transposed):
-        if not all(volume == 0 for volume in pitch_column):
-            ret.append(list(pitch_column))
-            columns_present.append(idx)
+    state_matrix = as_state_matrix(state_matrix)
 
-    ret = transpose(ret)
+    # Only keep the pitches which are ON at least once.
+    columns_present = np.flatnonzero(state_matrix.any(axis=0))
 
-    return ret, columns_present
+    return state_matrix[:, columns_present], columns_present
 
 
+@traced
 def decompress_state_matrix(state_matrix, columns_present):
     """
     Decompress the state-matrix.
     :param state_matrix: The state-matrix.
-    :type state_matrix: 2-D list
-    :param columns_present: A list of the column indices remaining from the
+    :type state_matrix: 2-D numpy array or StateRuns
+    :param columns_present: The column indices remaining from the
      original uncompressed state-matrix after compression .
-    :type columns_present: list
-    :returns: The decompressed state-matrix.
-    :return_type: 2-D list
+    :type columns_present: 1-D numpy array or list
+    :returns: The decompressed state-matrix (run-length encoded if the input
+     is).
+    :return_type: 2-D numpy array or StateRuns
     """
-    ret = [[0] * 128] * len(state_matrix)
-    ret = transpose(ret)
-
-    state_matrix_transposed = transpose(state_matrix)
+    if isinstance(state_matrix, StateRuns):
+        return StateRuns(decompress_state_matrix(
+            state_matrix.states, columns_present), state_matrix.durations)
 
-    for idx, col in enumerate(columns_present):
-        ret[col] = list(state_matrix_transposed[idx])
+    state_matrix = as_state_matrix(state_matrix)
 
-    ret = transpose(ret)
+    ret = new_state_matrix(len(state_matrix))
+    ret[:, columns_present] = state_matrix
 
     return ret
 
@@ -125,7 +290,7 @@ def main():
     print desparsify_state_matrix(state_matrix_decompressed)
     print '\n\n\n'
 
-    assert(state_matrix == state_matrix_decompressed)
+    assert(np.array_equal(state_matrix, state_matrix_decompressed))
 
     batch_size = 60
     print len(state_matrix)
@@ -3,6 +3,7 @@
 Utilities for debugging midi.
 '''
 import midi
+import numpy as np
 from pprint import pprint
 
 
@@ -12,15 +13,11 @@ def desparsify_state(state):
     Used mainly for printing/debugging.
     :param state: A sparse vector containing notes and their volumes.
      state[pitch] = volume
-    :type state: list
+    :type state: 1-D numpy array
     :returns: A list of the notes which are ON in the input state.
     :return_type: list
     """
-    ret = []
-    for pitch, volume in enumerate(state):
-        if volume > 0:
-            ret.append(pitch)
-    return ret
+    return np.flatnonzero(state).tolist()
 
 
 def desparsify_state_matrix(state_matrix):
@@ -29,7 +26,7 @@ def desparsify_state_matrix(state_matrix):
     Used mainly for printing/debugging.
     :param state_matrix: A sparse matrix containing notes and their volumes.
      state_matrix[state_index][pitch] = volume
-    :type state_matrix: 2-D list
+    :type state_matrix: 2-D numpy array
     :returns: A matrix of the notes which are ON in a state.
     :return_type: str
     """
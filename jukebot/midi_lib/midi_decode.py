@@ -0,0 +1,218 @@
+#!/usr/bin/env python2
+'''
+Fast midi decoder.
+Reads the bytes of a standard midi file directly into arrays of note events,
+without building a python-midi Pattern (one object per event).
+'''
+import os
+import struct
+import time
+
+import midi
+import numpy as np
+
+from midi_sequence import midi_to_sequence
+from midi_trace import traced
+from midi_tracks import TrackNotes, tracks_to_runs
+
+# The number of data bytes following each channel-message status.
+CHANNEL_MESSAGE_LENGTHS = {
+    0x80: 2, 0x90: 2, 0xA0: 2, 0xB0: 2, 0xC0: 1, 0xD0: 1, 0xE0: 2,
+}
+
+META_EVENT = 0xFF
+META_END_OF_TRACK = 0x2F
+META_SET_TEMPO = 0x51
+SYSEX_EVENTS = (0xF0, 0xF7)
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+
+
+def read_varlen(data, pos):
+    """
+    Reads a variable-length quantity.
+    :param data: The bytes.
+    :type data: bytearray
+    :param pos: The position of the first byte of the quantity.
+    :type pos: int
+    :returns: The value and the position of the byte following it.
+    :return_type: (int, int)
+    """
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+
+def decode_track(data, start, end):
+    """
+    Decodes the events of a track chunk.
+    :param data: The bytes of the midi file.
+    :type data: bytearray
+    :param start: The position of the first event of the track.
+    :type start: int
+    :param end: The position following the last byte of the track.
+    :type end: int
+    :returns: The note events of the track.
+    :return_type: TrackNotes
+    """
+    # A note event takes at least 3 bytes (with running status).
+    max_events = (end - start) // 3 + 1
+    times = np.empty(max_events, dtype=np.int64)
+    pitches = np.empty(max_events, dtype=np.uint8)
+    velocities = np.empty(max_events, dtype=np.uint8)
+    nb_events = 0
+
+    tempo_events = []
+    end_of_track = False
+    running_status = None
+    event_index = 0
+    tick = 0
+    pos = start
+
+    while pos < end:
+        delta, pos = read_varlen(data, pos)
+        tick += delta
+        status = data[pos]
+
+        if status == META_EVENT:
+            command = data[pos + 1]
+            length, pos = read_varlen(data, pos + 2)
+            if command == META_END_OF_TRACK:
+                end_of_track = True
+                break
+            elif command == META_SET_TEMPO:
+                tempo_events.append((tick, event_index, midi.SetTempoEvent(
+                    tick=delta, data=list(data[pos: pos + length]))))
+            pos += length
+        elif status in SYSEX_EVENTS:
+            length, pos = read_varlen(data, pos + 1)
+            pos += length
+        else:
+            if status & 0x80:
+                running_status = status
+                pos += 1
+            elif running_status is None:
+                raise ValueError('Running status used before any status at ' +
+                                 'byte ' + str(pos))
+            message = running_status & 0xF0
+            if message == NOTE_ON or message == NOTE_OFF:
+                times[nb_events] = tick
+                pitches[nb_events] = data[pos]
+                velocities[nb_events] = \
+                    data[pos + 1] if message == NOTE_ON else 0
+                nb_events += 1
+            pos += CHANNEL_MESSAGE_LENGTHS[message]
+
+        event_index += 1
+
+    return TrackNotes(times[:nb_events], pitches[:nb_events],
+                      velocities[:nb_events], end_of_track, tempo_events)
+
+
+def decode_midi_file(filepath):
+    """
+    Decodes a midi file.
+    :param filepath: The path of the midi file.
+    :type filepath: str
+    :returns: The resolution, the format and the note events of each track.
+    :return_type: (int, int, list of TrackNotes)
+    """
+    with open(filepath, 'rb') as midi_file:
+        data = bytearray(midi_file.read())
+
+    magic, header_size, format, nb_tracks, resolution = struct.unpack_from(
+        '>4sLHHH', bytes(data[:14]))
+    if magic != 'MThd':
+        raise TypeError('Bad header in MIDI file.')
+
+    tracks = []
+    pos = 8 + header_size
+    for _ in xrange(nb_tracks):
+        magic, track_size = struct.unpack_from('>4sL', bytes(data[pos: pos + 8]))
+        if magic != 'MTrk':
+            raise TypeError('Bad track header in MIDI file: ' + magic)
+        pos += 8
+        tracks.append(decode_track(data, pos, pos + track_size))
+        pos += track_size
+
+    return resolution, format, tracks
+
+
+@traced
+def midi_to_sequence_fast(filepath, run_length=False, grid=None):
+    """
+    Same as midi_to_sequence(), but decodes the midi file directly.
+    Loads a midi file and outputs the corresponding 'state_matrix'.
+    state_matrix[tick][pitch] = volume
+    :param filepath: The path of the midi file.
+    :type filepath: str
+    :param run_length: Whether to output the state-matrix run-length encoded
+     instead of expanding it to one row per tick.
+    :type run_length: bool
+    :param grid: The number of rows per beat to quantize the notes to
+     (None keeps one row per tick). The resolution of the meta-info is then
+     the grid, so that sequence_to_midi() plays the rows at the same tempo.
+    :type grid: int or None
+    :returns: The state-matrix and some meta-info (resolution, tempo_event)
+    :return_type: (2-D numpy array or StateRuns, (int, SetTempoEvent or None))
+    """
+    resolution, format, tracks = decode_midi_file(filepath)
+    state_matrix, tempo_event = tracks_to_runs(tracks, format, resolution,
+                                               grid)
+    if not run_length:
+        state_matrix = state_matrix.to_state_matrix()
+
+    return state_matrix, (grid or resolution, tempo_event)
+
+
+def benchmark(file_paths, repeat=3):
+    """
+    Compares midi_to_sequence() and midi_to_sequence_fast().
+    :param file_paths: The midi files to decode.
+    :type file_paths: list
+    :param repeat: The number of runs (the best one is reported).
+    :type repeat: int
+    :returns: The best time (in seconds) of each decoder for each file.
+    :return_type: list of (str, float, float)
+    """
+    def best_time(decoder, file_path):
+        times = []
+        for _ in xrange(repeat):
+            start = time.time()
+            decoder(file_path, run_length=True)
+            times.append(time.time() - start)
+        return min(times)
+
+    ret = []
+    for file_path in file_paths:
+        ret.append((file_path, best_time(midi_to_sequence, file_path),
+                    best_time(midi_to_sequence_fast, file_path)))
+    return ret
+
+
+def main():
+    music_dir = os.path.join('..', 'music')
+    file_paths = [os.path.join(music_dir, file)
+                  for file in sorted(os.listdir(music_dir))]
+
+    for file_path in file_paths:
+        state_matrix, meta_info = midi_to_sequence(file_path)
+        state_matrix_fast, meta_info_fast = midi_to_sequence_fast(file_path)
+        assert(np.array_equal(state_matrix, state_matrix_fast))
+        assert(str(meta_info) == str(meta_info_fast))
+        state_matrix, _ = midi_to_sequence(file_path, grid=4)
+        state_matrix_fast, _ = midi_to_sequence_fast(file_path, grid=4)
+        assert(np.array_equal(state_matrix, state_matrix_fast))
+
+    print '%-32s %12s %12s %8s' % ('file', 'python-midi', 'direct', 'speedup')
+    for file_path, slow, fast in benchmark(file_paths):
+        print '%-32s %11.4fs %11.4fs %7.1fx' % (
+            os.path.basename(file_path), slow, fast, slow / fast)
+
+
+if __name__ == '__main__':
+    main()
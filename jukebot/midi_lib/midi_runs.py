@@ -0,0 +1,210 @@
+#!/usr/bin/env python2
+'''
+Run-length encoded state-matrix.
+Consecutive identical states are stored once along with the number of ticks
+they last, so the memory used scales with the number of note events rather
+than with the number of ticks.
+'''
+import numpy as np
+
+from midi_debug import *
+from midi_state import NUM_PITCHES, STATE_DTYPE, as_state_matrix, \
+    new_state_matrix
+
+
+class StateRuns(object):
+    """
+    A run-length encoded state-matrix.
+    The state states[i] lasts for durations[i] consecutive ticks.
+    """
+
+    def __init__(self, states, durations):
+        """
+        :param states: The state of each run.
+        :type states: 2-D numpy array
+        :param durations: The number of ticks in each run.
+        :type durations: 1-D array-like of int
+        """
+        self.states = as_state_matrix(states)
+        self.durations = np.asarray(durations, dtype=np.int64)
+        if len(self.states) != len(self.durations):
+            raise ValueError('Got ' + str(len(self.states)) + ' states but ' +
+                             str(len(self.durations)) + ' durations')
+        self.starts = np.zeros(len(self.durations), dtype=np.int64)
+        np.cumsum(self.durations[:-1], out=self.starts[1:])
+
+    def __len__(self):
+        """
+        :returns: The number of ticks.
+        :return_type: int
+        """
+        return int(self.durations.sum())
+
+    @property
+    def nb_columns(self):
+        """
+        The width of a state.
+        """
+        return self.states.shape[1]
+
+    @classmethod
+    def from_state_matrix(cls, state_matrix):
+        """
+        Run-length encodes a (dense) state-matrix.
+        :param state_matrix: The state-matrix.
+        :type state_matrix: 2-D numpy array
+        :returns: The runs.
+        :return_type: StateRuns
+        """
+        state_matrix = as_state_matrix(state_matrix)
+        changed = (state_matrix[1:] != state_matrix[:-1]).any(axis=1)
+        starts = np.concatenate(([0], np.flatnonzero(changed) + 1))
+        if not len(state_matrix):
+            starts = starts[:0]
+        durations = np.diff(np.append(starts, len(state_matrix)))
+        return cls(state_matrix[starts], durations)
+
+    @classmethod
+    def from_events(cls, ticks, pitches, volumes, nb_ticks,
+                    nb_pitches=NUM_PITCHES):
+        """
+        Builds the runs from a list of volume changes.
+        The change (ticks[i], pitches[i], volumes[i]) sets the volume of the
+        pitch from tick ticks[i] onwards, until the next change of the same
+        pitch. Changes are applied in the order given.
+        :param ticks: The tick at which each change takes effect.
+        :type ticks: 1-D array-like of int (non-decreasing)
+        :param pitches: The pitch affected by each change.
+        :type pitches: 1-D array-like of int
+        :param volumes: The new volume of the pitch.
+        :type volumes: 1-D array-like of int
+        :param nb_ticks: The total number of ticks.
+        :type nb_ticks: int
+        :returns: The runs.
+        :return_type: StateRuns
+        """
+        ticks = np.asarray(ticks, dtype=np.int64)
+        pitches = np.asarray(pitches, dtype=np.int64)
+        volumes = np.asarray(volumes, dtype=np.int16)
+
+        keep = ticks < nb_ticks
+        ticks, pitches, volumes = ticks[keep], pitches[keep], volumes[keep]
+
+        if nb_ticks <= 0:
+            return cls(new_state_matrix(0, nb_pitches), [])
+
+        # A new run starts wherever some change happens.
+        starts = np.union1d([0], ticks)
+        durations = np.diff(np.append(starts, nb_ticks))
+        runs = np.searchsorted(starts, ticks, side='right') - 1
+
+        # Group the changes by pitch (keeping their order within a pitch),
+        # and compute by how much each one changes the volume of its pitch.
+        order = np.argsort(pitches, kind='mergesort')
+        runs, pitches, volumes = runs[order], pitches[order], volumes[order]
+        previous = np.zeros_like(volumes)
+        previous[1:] = volumes[:-1]
+        previous[np.flatnonzero(np.diff(pitches)) + 1] = 0
+        if len(previous):
+            previous[0] = 0
+
+        # Scatter the deltas and integrate them over the runs.
+        states = np.zeros((len(starts), nb_pitches), dtype=np.int16)
+        np.add.at(states, (runs, pitches), volumes - previous)
+        np.cumsum(states, axis=0, out=states)
+
+        return cls(states.astype(STATE_DTYPE), durations)
+
+    def to_state_matrix(self, start=0, stop=None):
+        """
+        Expands (a range of ticks of) the runs to a dense state-matrix.
+        :param start: The first tick.
+        :type start: int
+        :param stop: One past the last tick; defaults to the end.
+        :type stop: int or None
+        :returns: The state-matrix of the ticks [start, stop).
+        :return_type: 2-D numpy array
+        """
+        nb_ticks = len(self)
+        stop = nb_ticks if stop is None else min(stop, nb_ticks)
+        if stop <= start:
+            return new_state_matrix(0, self.nb_columns)
+
+        first = np.searchsorted(self.starts, start, side='right') - 1
+        last = np.searchsorted(self.starts, stop, side='left')
+        durations = self.durations[first:last].copy()
+        durations[0] -= start - self.starts[first]
+        durations[-1] -= self.starts[last - 1] + \
+            self.durations[last - 1] - stop
+
+        return np.repeat(self.states[first:last], durations, axis=0)
+
+    def iter_chunks(self, chunk_size):
+        """
+        Lazily expands the runs, chunk_size ticks at a time.
+        :param chunk_size: The number of ticks per chunk.
+        :type chunk_size: int
+        :returns: The dense chunks, in order.
+        :return_type: generator of 2-D numpy array
+        """
+        for start in xrange(0, len(self), chunk_size):
+            yield self.to_state_matrix(start, start + chunk_size)
+
+    def prefix_sums(self, ticks):
+        """
+        Computes the sum of all the states before each of the given ticks.
+        :param ticks: The ticks.
+        :type ticks: 1-D array-like of int
+        :returns: sums[i] = state_matrix[:ticks[i]].sum(axis=0)
+        :return_type: 2-D numpy array (uint64)
+        """
+        ticks = np.asarray(ticks, dtype=np.int64)
+        if not len(self.states):
+            return np.zeros((len(ticks), self.nb_columns), dtype=np.uint64)
+
+        totals = np.zeros((len(self.states) + 1, self.nb_columns),
+                          dtype=np.uint64)
+        np.cumsum(self.states * self.durations[:, np.newaxis].astype(
+            np.uint64), axis=0, out=totals[1:])
+
+        runs = np.searchsorted(self.starts, ticks, side='right') - 1
+        runs = runs.clip(min=0)
+        elapsed = (ticks - self.starts[runs]).clip(min=0).astype(np.uint64)
+        return totals[runs] + self.states[runs] * elapsed[:, np.newaxis]
+
+
+def concatenate_runs(runs_list, nb_columns=NUM_PITCHES):
+    """
+    Joins several runs one after the other.
+    :param runs_list: The runs.
+    :type runs_list: list of StateRuns
+    :param nb_columns: The width of a state (used if runs_list is empty).
+    :type nb_columns: int
+    :returns: The joined runs.
+    :return_type: StateRuns
+    """
+    if not runs_list:
+        return StateRuns(new_state_matrix(0, nb_columns), [])
+    return StateRuns(np.concatenate([runs.states for runs in runs_list]),
+                     np.concatenate([runs.durations for runs in runs_list]))
+
+
+def main():
+    filepath = 'debug.mid'
+    from midi_sequence import midi_to_sequence
+    runs, _ = midi_to_sequence(filepath, run_length=True)
+    state_matrix, _ = midi_to_sequence(filepath)
+
+    print runs.durations
+    print desparsify_state_matrix(runs.states)
+    print '\n\n\n'
+
+    assert(np.array_equal(runs.to_state_matrix(), state_matrix))
+    assert(np.array_equal(
+        StateRuns.from_state_matrix(state_matrix).to_state_matrix(),
+        state_matrix))
+    assert(np.array_equal(runs.to_state_matrix(2, 5), state_matrix[2:5]))
+
+
+if __name__ == '__main__':
+    main()
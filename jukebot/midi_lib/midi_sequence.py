@@ -1,106 +1,198 @@
 #!/usr/bin/env python2
 '''
 Convert midi pattern to matrix and back.
-Currently full support provided for midi-format 0 only.
-Use for format 1 and 2 at your own risk !
+The tracks of format 0 and 1 files are merged (see midi_tracks), those of
+format 2 files are played one after the other.
 '''
 import midi
-from copy import copy
+import numpy as np
 from pprint import pprint
 
+from midi_state import NUM_PITCHES, STATE_DTYPE, as_state_matrix
+from midi_trace import traced
+from midi_tracks import TrackNotes, tracks_to_runs
 
-def midi_to_sequence(filepath):
+
+@traced
+def midi_to_sequence(filepath, run_length=False, grid=None):
     """
     Loads a midi file and outputs the corresponding 'state_matrix'.
     state_matrix[tick][pitch] = volume
     Each row corresponds to the state of notes in a tick.
     :param filepath: The path of the midi file.
     :type filepath: str
+    :param run_length: Whether to output the state-matrix run-length encoded
+     instead of expanding it to one row per tick.
+    :type run_length: bool
+    :param grid: The number of rows per beat to quantize the notes to
+     (None keeps one row per tick). The resolution of the meta-info is then
+     the grid, so that sequence_to_midi() plays the rows at the same tempo.
+    :type grid: int or None
     :returns: The state-matrix and some meta-info (resolution, tempo_event)
-    :return_type: (2-D list, (int, SetTempoEvent or None))
+    :return_type: (2-D numpy array or StateRuns, (int, SetTempoEvent or None))
     """
-    state_matrix = []
+    tracks = []
 
     pattern = midi.read_midifile(filepath)
     #pprint(pattern, open('pattern_correct', 'w'))
 
-    tempo_event = None
-
     for track in pattern:
-        # Null state
-        state = [0] * 128
-        for event in track:
+        # The volume changes of the track, and the tick at which each of them
+        # takes effect.
+        ticks = []
+        pitches = []
+        volumes = []
+        # The tempo changes are not required for RNN training,
+        # but are required to generate coherent music.
+        tempo_events = []
+        end_of_track = False
+        nb_ticks = 0
+        for event_index, event in enumerate(track):
+            nb_ticks += event.tick
             if isinstance(event, midi.EndOfTrackEvent):
-                # Append the final state 1 time as EndOfTrackEvent has tick = 1
-                state_matrix += [copy(state)]
+                end_of_track = True
                 break
             elif isinstance(event, midi.NoteEvent):
-                if event.tick > 0:
-                    # A change in state has happened.
-                    # Append the current state to the state_matrix.
-                    state_matrix += event.tick * [copy(state)]
+                # A change in state has happened.
+                ticks.append(nb_ticks)
+                pitches.append(event.pitch)
                 if isinstance(event, midi.NoteOffEvent):
                     # Make the volume of the pitch to be 0
-                    state[event.pitch] = 0
+                    volumes.append(0)
                 else:
-                    state[event.pitch] = event.data[1]
-
-        # Find the tempo-event in the track.
-        # This is not required for RNN training.
-        # But is required to generate coherent music.
-        for i in xrange(min(10, len(track))):
-            if isinstance(track[i], midi.SetTempoEvent):
-                tempo_event = track[i]
-                break
+                    volumes.append(event.data[1])
+            elif isinstance(event, midi.SetTempoEvent):
+                tempo_events.append((nb_ticks, event_index, event))
+
+        tracks.append(TrackNotes(
+            np.array(ticks, dtype=np.int64), np.array(pitches, dtype=np.uint8),
+            np.array(volumes, dtype=np.uint8), end_of_track, tempo_events))
 
-    return state_matrix, (pattern.resolution, tempo_event)
+    state_matrix, tempo_event = tracks_to_runs(
+        tracks, pattern.format, pattern.resolution, grid)
+    if not run_length:
+        state_matrix = state_matrix.to_state_matrix()
 
+    return state_matrix, (grid or pattern.resolution, tempo_event)
 
-def get_next_different_state(state_matrix, index):
+
+def state_transitions(state_matrix, previous_state, elapsed=0):
     """
     Helper for sequence_to_midi().
-    Find the index of the next state which is different from the input state.
+    Finds all the changes of state in a state-matrix (in a single pass),
+    and the notes which are turned ON/OFF by each of them.
     :param state_matrix: The state-matrix.
-    :type state_matrix: 2-D list
-    :returns: The index of the (chronological) next state which is different
-     from the input state.
-    :return_type: int
+    :type state_matrix: 2-D numpy array
+    :param previous_state: The state before the first row.
+    :type previous_state: 1-D numpy array
+    :param elapsed: The number of ticks previous_state has already lasted.
+    :type elapsed: int
+    :returns: The note events (in order) as (ticks_elapsed, pitch, volume),
+     volume being 0 for the notes turned OFF, along with the state of the last
+     row and the number of ticks it lasts at the end of the state-matrix.
+    :return_type: (list, 1-D numpy array, int)
     """
-    for i in xrange(index + 1, len(state_matrix)):
-        if state_matrix[i] != state_matrix[index]:
-            return i
-    return len(state_matrix)
+    previous_rows = np.empty_like(state_matrix)
+    previous_rows[1:] = state_matrix[:-1]
+    previous_rows[:1] = previous_state
+    changes = np.flatnonzero((state_matrix != previous_rows).any(axis=1))
+
+    if not len(changes):
+        return [], previous_state, elapsed + len(state_matrix)
+
+    current_states = previous_rows[changes]
+    next_states = state_matrix[changes]
+    # The number of ticks each state has lasted when it changes.
+    ticks_elapsed = np.diff(np.append(-elapsed, changes))
+
+    # All the NoteOn events of a change come first, then its NoteOff events,
+    # each in increasing order of pitch.
+    changes_on, pitches_on = np.nonzero(
+        (current_states == 0) & (next_states > 0))
+    changes_off, pitches_off = np.nonzero(
+        (current_states > 0) & (next_states == 0))
+    change_indices = np.concatenate((changes_on, changes_off))
+    order = np.argsort(
+        change_indices * 2 + np.repeat([0, 1], (len(changes_on),
+                                                len(changes_off))),
+        kind='mergesort')
+    change_indices = change_indices[order]
+    pitches = np.concatenate((pitches_on, pitches_off))[order]
+    volumes = np.concatenate((next_states[changes_on, pitches_on],
+                              np.zeros(len(changes_off), dtype=np.uint8)))[order]
 
+    # The rest of the events of a change are happening simultaneously,
+    # so their ticks_elapsed = 0.
+    ticks = np.zeros(len(change_indices), dtype=np.int64)
+    first = np.ones(len(change_indices), dtype=bool)
+    first[1:] = change_indices[1:] != change_indices[:-1]
+    ticks[first] = ticks_elapsed[change_indices[first]]
 
-def state_diff(current_state, next_state):
+    events = zip(ticks.tolist(), pitches.tolist(), volumes.tolist())
+    return events, state_matrix[-1], len(state_matrix) - changes[-1]
+
+
+def note_events(events):
     """
     Helper for sequence_to_midi().
-    Finds the notes that have changed state (ON/OFF) between 2 states (ticks).
-    :param current_state: The first state.
-    :type current_state: list
-    :param next_state: The chronologically second state.
-    :type next_state: list
-    :returns: The set of notes which have been changed b/w 2 states.
-    :return_type: (list, list)
+    Creates the midi events corresponding to the output of state_transitions().
+    :param events: The note events as (ticks_elapsed, pitch, volume).
+    :type events: list
+    :returns: The midi events.
+    :return_type: list
+    """
+    return [midi.NoteOnEvent(tick=tick, channel=0, data=[pitch, volume])
+            if volume else
+            midi.NoteOffEvent(tick=tick, channel=0, data=[pitch, 0])
+            for tick, pitch, volume in events]
+
+
+class StateEncoder(object):
+    """
+    Incrementally converts the rows of a state-matrix to midi events.
     """
-    notes_on = []
-    notes_off = []
 
-    for pitch, (volume1, volume2) in enumerate(zip(current_state, next_state)):
-        if volume1 == 0 and volume2 > 0:
-            notes_on.append([pitch, volume2])
-        elif volume1 > 0 and volume2 == 0:
-            notes_off.append([pitch, volume2])
+    def __init__(self, nb_columns=NUM_PITCHES):
+        """
+        :param nb_columns: The width of a state.
+        :type nb_columns: int
+        """
+        # Start from silence, so that the very first tick only has NoteOn
+        # events.
+        self.state = np.zeros(nb_columns, dtype=STATE_DTYPE)
+        self.ticks_elapsed = 0
 
-    return (notes_on, notes_off)
+    def encode(self, state_matrix):
+        """
+        Converts the next rows of the state-matrix.
+        :param state_matrix: The rows.
+        :type state_matrix: 2-D numpy array
+        :returns: The midi events.
+        :return_type: list
+        """
+        events, state, self.ticks_elapsed = state_transitions(
+            as_state_matrix(state_matrix), self.state, self.ticks_elapsed)
+        self.state = state.copy()
+        return note_events(events)
 
+    def finish(self):
+        """
+        Turns OFF the notes still ON at the end, and ends the track.
+        :returns: The midi events.
+        :return_type: list
+        """
+        ret = self.encode(np.zeros_like(self.state)[np.newaxis])
+        ret.append(midi.EndOfTrackEvent(tick=1))
+        return ret
 
+
+@traced
 def sequence_to_midi(state_matrix, filepath, meta_info=None):
     """
     Converts a state_matrix to the corresponding 'pattern'
     and writes the pattern as a midi file.
     :param state_matrix: The state matrix.
-    :type state_matrix: 2-D list
+    :type state_matrix: 2-D list or 2-D numpy array
     :param filepath: The path of the output midi file.
     :type filepath: str
     :param meta_info: Resolution and tempo-event of the pattern.
@@ -109,6 +201,7 @@ def sequence_to_midi(state_matrix, filepath, meta_info=None):
     :return_type: list
     """
     resolution, tempo_event = meta_info if meta_info else None
+    state_matrix = as_state_matrix(state_matrix)
 
     pattern = midi.Pattern(resolution=resolution)
     track = midi.Track()
@@ -116,43 +209,79 @@ def sequence_to_midi(state_matrix, filepath, meta_info=None):
     if tempo_event:
         track.append(tempo_event)
 
-    # Append the very first tick (which will only have NoteOn events)
-    notes_on, _ = state_diff([0] * 128, state_matrix[0])
-    for note in notes_on:
-        track.append(midi.NoteOnEvent(tick=0, channel=0, data=note))
-
-    # Append the rest of the ticks
-    current_state_index = 0
-    while current_state_index < len(state_matrix):
-        next_state_index = get_next_different_state(
-            state_matrix, current_state_index)
-        ticks_elapsed = next_state_index - current_state_index
-
-        current_state = state_matrix[current_state_index]
-        next_state = state_matrix[next_state_index] if next_state_index < len(
-            state_matrix) else [0] * 128
-        notes_on, notes_off = state_diff(current_state, next_state)
-
-        for note in notes_on:
-            track.append(midi.NoteOnEvent(
-                tick=ticks_elapsed, channel=0, data=note))
-            # The rest of the events are happening simultaneously,
-            # so set time_elapsed (tick) = 0 for them
-            ticks_elapsed = 0
-
-        for note in notes_off:
-            track.append(midi.NoteOffEvent(
-                tick=ticks_elapsed, channel=0, data=note))
-            ticks_elapsed = 0
-
-        current_state_index = next_state_index
-
-    track.append(midi.EndOfTrackEvent(tick=1))
+    encoder = StateEncoder(state_matrix.shape[1])
+    track.extend(encoder.encode(state_matrix))
+    track.extend(encoder.finish())
+
     midi.write_midifile(filepath, pattern)
 
     return pattern
 
 
+class MidiStreamWriter(object):
+    """
+    Writes a state-matrix to a (single track) midi file as its rows are
+    produced, without keeping the rows or the midi events in memory.
+    The output is identical to that of sequence_to_midi().
+    """
+
+    def __init__(self, filepath, meta_info=None):
+        """
+        :param filepath: The path of the output midi file.
+        :type filepath: str
+        :param meta_info: Resolution and tempo-event of the pattern.
+        :type meta_info: (int, SetTempoEvent or None) or None
+        """
+        resolution, tempo_event = meta_info if meta_info else None
+
+        pattern = midi.Pattern(resolution=resolution)
+        pattern.append(midi.Track())
+
+        self.midi_file = open(filepath, 'wb')
+        self.writer = midi.FileWriter()
+        self.writer.write_file_header(self.midi_file, pattern)
+        # The size of the track is only known at the end.
+        self.track_start = self.midi_file.tell()
+        self.midi_file.write(self.writer.encode_track_header(0))
+        self.writer.RunningStatus = None
+
+        self.encoder = StateEncoder()
+        if tempo_event:
+            self.write_events([tempo_event])
+
+    def write_events(self, events):
+        """
+        Appends midi events to the track.
+        :param events: The midi events.
+        :type events: list
+        :returns: None
+        """
+        self.midi_file.write(''.join(
+            self.writer.encode_midi_event(event) for event in events))
+
+    def write(self, state_matrix):
+        """
+        Appends rows to the state-matrix.
+        :param state_matrix: The rows.
+        :type state_matrix: 2-D numpy array
+        :returns: None
+        """
+        self.write_events(self.encoder.encode(state_matrix))
+
+    def close(self):
+        """
+        Ends the track and closes the file.
+        :returns: None
+        """
+        self.write_events(self.encoder.finish())
+
+        track_end = self.midi_file.tell()
+        self.midi_file.seek(self.track_start)
+        self.midi_file.write(self.writer.encode_track_header(
+            track_end - self.track_start - 8))
+        self.midi_file.close()
+
+
 def main():
     filepath = 'debug.mid'
     state_matrix, meta_info = midi_to_sequence(filepath)
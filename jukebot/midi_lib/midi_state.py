@@ -0,0 +1,72 @@
+#!/usr/bin/env python2
+'''
+The array-backed state-matrix used throughout midi_lib.
+A state-matrix is a 2-D numpy array of dtype STATE_DTYPE with one row per
+tick and one column per pitch.
+state_matrix[tick][pitch] = volume
+Boolean state-matrices can also be bit-packed, 8 pitches per byte.
+'''
+import numpy as np
+
+
+# Number of pitches in a midi state (the width of an uncompressed matrix).
+NUM_PITCHES = 128
+
+# Volumes lie in [0, 127], so a single byte per cell is enough.
+STATE_DTYPE = np.uint8
+
+
+def new_state_matrix(nb_ticks, nb_pitches=NUM_PITCHES):
+    """
+    Allocates a silent (all zero) state-matrix.
+    :param nb_ticks: The number of rows.
+    :type nb_ticks: int
+    :param nb_pitches: The number of columns.
+    :type nb_pitches: int
+    :returns: The state-matrix.
+    :return_type: 2-D numpy array
+    """
+    return np.zeros((nb_ticks, nb_pitches), dtype=STATE_DTYPE)
+
+
+def as_state_matrix(state_matrix):
+    """
+    Converts a state-matrix given as a 2-D list (or any array-like)
+    to the array-backed representation.
+    No copy is made if the input already is one.
+    :param state_matrix: The state-matrix.
+    :type state_matrix: 2-D list or 2-D numpy array
+    :returns: The state-matrix.
+    :return_type: 2-D numpy array
+    """
+    ret = np.asarray(state_matrix, dtype=STATE_DTYPE)
+    if ret.ndim == 1 and ret.size == 0:
+        ret = ret.reshape(0, NUM_PITCHES)
+    if ret.ndim != 2:
+        raise ValueError('A state-matrix must be 2-D, got shape ' +
+                         str(ret.shape))
+    return ret
+
+
+def pack_state_matrix(state_matrix):
+    """
+    Packs a boolean state-matrix into bits (the pitches ON).
+    :param state_matrix: The state-matrix (or a batch of them).
+    :type state_matrix: numpy array
+    :returns: The packed state-matrix, with a byte per 8 pitches.
+    :return_type: numpy array
+    """
+    return np.packbits(np.asarray(state_matrix) > 0, axis=-1)
+
+
+def unpack_state_matrix(packed, nb_pitches=NUM_PITCHES):
+    """
+    Inverse of pack_state_matrix().
+    :param packed: The packed state-matrix (or a batch of them).
+    :type packed: numpy array
+    :param nb_pitches: The number of columns of the state-matrix.
+    :type nb_pitches: int
+    :returns: The boolean state-matrix (0 or 1 per cell).
+    :return_type: numpy array
+    """
+    return np.unpackbits(packed, axis=-1)[..., :nb_pitches]
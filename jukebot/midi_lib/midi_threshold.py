@@ -0,0 +1,223 @@
+#!/usr/bin/env python2
+'''
+Decoding of the notes of a generated state-matrix.
+The volumes predicted by the model are noisy: a pitch hovering around a
+small volume flickers ON and OFF, and every flicker becomes a NoteOn and a
+NoteOff event. A pitch is only turned ON above an upper threshold and OFF
+below a lower one (hysteresis), and notes shorter than a minimum duration
+are dropped.
+'''
+import numpy as np
+
+from midi_debug import *
+from midi_state import as_state_matrix
+from midi_trace import traced
+
+
+@traced
+def hysteresis(state_matrix, on_threshold, off_threshold, previous=None):
+    """
+    Turns a pitch ON when its volume reaches on_threshold and OFF when it
+    falls below off_threshold; in between, it keeps its previous state.
+    :param state_matrix: The state-matrix.
+    :type state_matrix: 2-D numpy array
+    :param on_threshold: The volume turning a pitch ON.
+    :type on_threshold: int
+    :param off_threshold: The volume below which a pitch is turned OFF
+     (between 1 and on_threshold).
+    :type off_threshold: int
+    :param previous: The pitches ON before the first row (none if None).
+    :type previous: 1-D numpy array of bool or None
+    :returns: The state-matrix with the volume of the pitches OFF set to 0,
+     and the pitches ON in its last row.
+    :return_type: (2-D numpy array, 1-D numpy array of bool)
+    """
+    if not 1 <= off_threshold <= on_threshold:
+        raise ValueError('The thresholds must satisfy 1 <= off_threshold '
+                         '<= on_threshold')
+    state_matrix = as_state_matrix(state_matrix)
+    nb_rows, nb_columns = state_matrix.shape
+    if previous is None:
+        previous = np.zeros(nb_columns, dtype=bool)
+
+    # Every cell takes the decision of the last cell above it (or itself)
+    # which is outside of the hysteresis band.
+    decided = (state_matrix >= on_threshold) | (state_matrix < off_threshold)
+    last_decided = np.where(decided, np.arange(nb_rows)[:, np.newaxis], -1)
+    np.maximum.accumulate(last_decided, axis=0, out=last_decided)
+    on = np.where(
+        last_decided >= 0,
+        state_matrix[last_decided.clip(min=0), np.arange(nb_columns)] >=
+        on_threshold,
+        previous)
+
+    last = on[-1] if nb_rows else previous
+    return np.where(on, state_matrix, 0).astype(state_matrix.dtype), last
+
+
+def note_runs(state_matrix):
+    """
+    Finds the notes of a state-matrix: the runs of consecutive rows in which
+    a pitch is ON.
+    :param state_matrix: The state-matrix.
+    :type state_matrix: 2-D numpy array
+    :returns: The first row, the row following the last one, and the pitch
+     of every note (the notes still ON in the first row start at row 0).
+    :return_type: (1-D numpy array, 1-D numpy array, 1-D numpy array)
+    """
+    on = np.asarray(state_matrix) > 0
+    padded = np.zeros((len(on) + 2, on.shape[1]), dtype=np.int8)
+    padded[1:-1] = on
+    changes = np.diff(padded, axis=0)
+    start_rows, start_pitches = np.nonzero(changes.T > 0)[::-1]
+    end_rows, _ = np.nonzero(changes.T < 0)[::-1]
+    # np.nonzero() on the transposed changes lists the notes pitch by pitch,
+    # so the starts and ends of a note have the same index.
+    return start_rows, end_rows, start_pitches
+
+
+@traced
+def remove_short_notes(state_matrix, min_duration, previous=None,
+                       open_ended=False):
+    """
+    Drops the notes lasting less than min_duration rows.
+    :param state_matrix: The state-matrix.
+    :type state_matrix: 2-D numpy array
+    :param min_duration: The minimum number of rows of a note.
+    :type min_duration: int
+    :param previous: The pitches ON before the first row, whose notes
+     continue a note already kept (none if None).
+    :type previous: 1-D numpy array of bool or None
+    :param open_ended: Whether the notes still ON in the last row may
+     continue after it (they are then kept).
+    :type open_ended: bool
+    :returns: The state-matrix, with the volume of the dropped notes set
+     to 0.
+    :return_type: 2-D numpy array
+    """
+    state_matrix = as_state_matrix(state_matrix).copy()
+    starts, ends, pitches = note_runs(state_matrix)
+    short = ends - starts < min_duration
+    if previous is not None:
+        short &= ~((starts == 0) & previous[pitches])
+    if open_ended:
+        short &= ends < len(state_matrix)
+    starts, ends, pitches = starts[short], ends[short], pitches[short]
+
+    # Mark the rows of the short notes (+1 at their start, -1 at their end).
+    marks = np.zeros((len(state_matrix) + 1, state_matrix.shape[1]),
+                     dtype=np.int32)
+    np.add.at(marks, (starts, pitches), 1)
+    np.add.at(marks, (ends, pitches), -1)
+    state_matrix[np.cumsum(marks, axis=0)[:-1] > 0] = 0
+    return state_matrix
+
+
+class NoteDecoder(object):
+    """
+    Incrementally decodes the notes of a state-matrix, chunk by chunk
+    (see hysteresis() and remove_short_notes()).
+    The decoded rows lag min_duration - 1 rows behind, since a note can
+    only be kept once it has lasted long enough.
+    """
+
+    def __init__(self, on_threshold=None, off_threshold=None, min_duration=1):
+        """
+        :param on_threshold: The volume turning a pitch ON (None disables
+         the hysteresis).
+        :type on_threshold: int or None
+        :param off_threshold: The volume below which a pitch is turned OFF
+         (defaults to on_threshold).
+        :type off_threshold: int or None
+        :param min_duration: The minimum number of rows of a note.
+        :type min_duration: int
+        """
+        self.on_threshold = on_threshold
+        self.off_threshold = off_threshold or on_threshold
+        if on_threshold is not None and \
+                not 1 <= self.off_threshold <= on_threshold:
+            raise ValueError('The thresholds must satisfy 1 <= off_threshold '
+                             '<= on_threshold')
+        self.min_duration = min_duration
+        # The pitches ON in the last row thresholded, and in the last row
+        # output.
+        self.thresholded_on = None
+        self.output_on = None
+        # The thresholded rows not output yet.
+        self.pending = None
+
+    def decode(self, state_matrix):
+        """
+        Decodes the next rows of the state-matrix.
+        :param state_matrix: The rows.
+        :type state_matrix: 2-D numpy array
+        :returns: The decoded rows which are final.
+        :return_type: 2-D numpy array
+        """
+        state_matrix = as_state_matrix(state_matrix)
+        if self.on_threshold is not None:
+            state_matrix, self.thresholded_on = hysteresis(
+                state_matrix, self.on_threshold, self.off_threshold,
+                self.thresholded_on)
+        if self.min_duration <= 1:
+            self.pending = state_matrix[:0]
+            return state_matrix
+
+        if self.pending is not None:
+            state_matrix = np.concatenate((self.pending, state_matrix))
+        nb_final = max(len(state_matrix) - (self.min_duration - 1), 0)
+        self.pending = state_matrix[nb_final:]
+        return self.remove_short_notes(state_matrix, nb_final,
+                                       open_ended=True)
+
+    def finish(self):
+        """
+        Decodes the rows held back at the end of the state-matrix.
+        :returns: The decoded rows.
+        :return_type: 2-D numpy array
+        """
+        if self.pending is None:
+            return as_state_matrix([])
+        state_matrix, self.pending = self.pending, None
+        return self.remove_short_notes(state_matrix, len(state_matrix))
+
+    def remove_short_notes(self, state_matrix, nb_final, open_ended=False):
+        """
+        Drops the short notes of the rows held back and the new ones, and
+        outputs the first nb_final rows.
+        """
+        state_matrix = remove_short_notes(
+            state_matrix, self.min_duration, self.output_on,
+            open_ended)[:nb_final]
+        if len(state_matrix):
+            self.output_on = state_matrix[-1] > 0
+        return state_matrix
+
+
+def main():
+    # A long note with a dip, a flickering pitch and a blip.
+    state_matrix = np.zeros((12, 3), dtype=np.uint8)
+    state_matrix[:, 0] = [0, 90, 80, 30, 80, 90, 0, 0, 0, 0, 0, 0]
+    state_matrix[:, 1] = [0, 5, 40, 0, 45, 35, 50, 0, 45, 50, 45, 0]
+    state_matrix[:, 2] = [0, 0, 0, 0, 0, 0, 0, 0, 0, 70, 0, 0]
+    print desparsify_state_matrix(state_matrix)
+
+    decoder = NoteDecoder(on_threshold=40, off_threshold=20, min_duration=2)
+    decoded = np.concatenate(
+        [decoder.decode(state_matrix[start: start + 5])
+         for start in xrange(0, len(state_matrix), 5)] + [decoder.finish()])
+    print '\n\n\n'
+    print desparsify_state_matrix(decoded)
+
+    assert(np.array_equal(decoded[:, 0], state_matrix[:, 0]))
+    assert(np.array_equal(decoded[:, 1] > 0, [0, 0, 0, 0, 1, 1, 1, 0, 1, 1,
+                                              1, 0]))
+    assert(not decoded[:, 2].any())
+
+    # Decoding chunk by chunk is the same as decoding all the rows at once.
+    thresholded, _ = hysteresis(state_matrix, 40, 20)
+    assert(np.array_equal(remove_short_notes(thresholded, 2), decoded))
+
+
+if __name__ == '__main__':
+    main()
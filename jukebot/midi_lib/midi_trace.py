@@ -0,0 +1,238 @@
+#!/usr/bin/env python2
+'''
+Lightweight instrumentation of the pipeline.
+The stages are wrapped in spans, which record their wall time, CPU time,
+peak memory and the size of the arrays they handle.
+Tracing is disabled by default, in which case spans cost (almost) nothing.
+'''
+import functools
+import json
+import os
+import resource
+import threading
+import time
+
+import numpy as np
+
+
+# Whether the spans are recorded.
+enabled = False
+
+# The finished spans, in the order they ended.
+records = []
+
+# The spans currently open (per thread).
+open_spans = threading.local()
+
+# The time the trace starts at.
+trace_start = time.time()
+
+
+def enable():
+    """
+    Starts recording the spans (discarding the ones recorded so far).
+    :returns: None
+    """
+    global enabled, trace_start
+    enabled = True
+    trace_start = time.time()
+    del records[:]
+
+
+def peak_rss():
+    """
+    The peak resident memory of the process so far.
+    :returns: The peak resident memory (in bytes).
+    :return_type: int
+    """
+    # Linux reports it in kilobytes.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def cpu_time():
+    """
+    The CPU time (user and system) used by the process so far.
+    :returns: The CPU time (in seconds).
+    :return_type: float
+    """
+    times = os.times()
+    return times[0] + times[1]
+
+
+def describe(value):
+    """
+    Summarizes a value recorded in a span.
+    Arrays are reduced to their shape, type and size.
+    :param value: The value.
+    :type value: any
+    :returns: A JSON-serializable description of the value.
+    :return_type: any
+    """
+    if isinstance(value, np.ndarray):
+        return {'shape': list(value.shape), 'dtype': str(value.dtype),
+                'nbytes': int(value.nbytes)}
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class Span(object):
+    """
+    Measures a stage of the pipeline. Used as a context manager:
+        with span('stage', size=len(x)) as stage:
+            ...
+            stage.set(output=array)
+    """
+
+    def __init__(self, name, info):
+        """
+        :param name: The name of the stage.
+        :type name: str
+        :param info: Values describing the stage (e.g. its input arrays).
+        :type info: dict
+        """
+        self.name = name
+        self.info = info
+
+    def set(self, **info):
+        """
+        Records more values describing the stage.
+        :returns: None
+        """
+        if enabled:
+            self.info.update(info)
+
+    def __enter__(self):
+        if not enabled:
+            return self
+        stack = getattr(open_spans, 'stack', None)
+        if stack is None:
+            stack = open_spans.stack = []
+        self.parent = stack[-1].name if stack else None
+        self.depth = len(stack)
+        stack.append(self)
+
+        self.rss_start = peak_rss()
+        self.cpu_start = cpu_time()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not enabled or not hasattr(self, 'start'):
+            return False
+        wall = time.time() - self.start
+        cpu = cpu_time() - self.cpu_start
+        rss = peak_rss()
+        open_spans.stack.pop()
+
+        records.append({
+            'name': self.name,
+            'parent': self.parent,
+            'depth': self.depth,
+            'start': self.start - trace_start,
+            'wall': wall,
+            'cpu': cpu,
+            'peak_rss': rss,
+            'rss_growth': rss - self.rss_start,
+            'info': dict((key, describe(value))
+                         for key, value in self.info.iteritems()),
+            'error': exc_type.__name__ if exc_type else None,
+        })
+        return False
+
+
+def span(name, **info):
+    """
+    Creates a span measuring a stage of the pipeline.
+    :param name: The name of the stage.
+    :type name: str
+    :param info: Values describing the stage (e.g. its input arrays).
+    :returns: The span, to be used as a context manager.
+    :return_type: Span
+    """
+    return Span(name, info)
+
+
+def traced(func):
+    """
+    Decorator wrapping every call of a function in a span.
+    The output of the function is recorded if it is an array
+    (or a tuple starting with an array).
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return func(*args, **kwargs)
+        with span(func.__name__) as call:
+            ret = func(*args, **kwargs)
+            output = ret[0] if isinstance(ret, tuple) and ret else ret
+            if isinstance(output, np.ndarray):
+                call.set(output=output)
+            return ret
+    return wrapper
+
+
+def summarize():
+    """
+    Aggregates the recorded spans by name.
+    :returns: For every name (in the order they first started): the number of
+     spans, their total wall and CPU times, and the highest peak memory and
+     memory growth.
+    :return_type: list of dict
+    """
+    summary = []
+    by_name = {}
+    for record in sorted(records, key=lambda record: record['start']):
+        entry = by_name.get(record['name'])
+        if entry is None:
+            entry = by_name[record['name']] = {
+                'name': record['name'], 'depth': record['depth'],
+                'calls': 0, 'wall': 0., 'cpu': 0., 'peak_rss': 0,
+                'rss_growth': 0}
+            summary.append(entry)
+        entry['calls'] += 1
+        entry['wall'] += record['wall']
+        entry['cpu'] += record['cpu']
+        entry['peak_rss'] = max(entry['peak_rss'], record['peak_rss'])
+        entry['rss_growth'] = max(entry['rss_growth'], record['rss_growth'])
+    return summary
+
+
+def print_summary():
+    """
+    Prints the aggregated spans as a table.
+    :returns: None
+    """
+    print '%-32s %7s %10s %10s %10s %10s' % (
+        'span', 'calls', 'wall', 'cpu', 'peak RSS', 'RSS growth')
+    for entry in summarize():
+        print '%-32s %7d %9.3fs %9.3fs %7.1f MB %7.1f MB' % (
+            '  ' * entry['depth'] + entry['name'], entry['calls'],
+            entry['wall'], entry['cpu'], entry['peak_rss'] / 2. ** 20,
+            entry['rss_growth'] / 2. ** 20)
+
+
+def write_trace(filepath):
+    """
+    Writes the recorded spans (and their summary) as JSON.
+    :param filepath: The path of the output file.
+    :type filepath: str
+    :returns: None
+    """
+    with open(filepath, 'w') as trace_file:
+        json.dump({'records': records, 'summary': summarize()}, trace_file,
+                  indent=1, sort_keys=True)
+
+
+def main():
+    enable()
+    with span('outer') as outer:
+        state_matrix = np.zeros((1 << 16, 128), dtype=np.uint8)
+        outer.set(state_matrix=state_matrix)
+        for _ in xrange(3):
+            traced(np.cumsum)(state_matrix, axis=0)
+    print_summary()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python2
+'''
+Merging of the tracks of a midi file into a single state-matrix.
+In format 0 and 1 files all the tracks play at the same time: their note
+events are merged on their absolute tick, and the ticks are rescaled so that
+the tempo changes (usually found in the first track) are honored.
+In format 2 files every track is an independent sequence; the tracks are
+played one after the other.
+The ticks can also be quantized to a grid of a fixed number of rows per beat,
+so that files of different resolutions give rows of the same length.
+'''
+import heapq
+from collections import namedtuple
+from itertools import izip, repeat
+
+import numpy as np
+
+from midi_runs import StateRuns, concatenate_runs
+from midi_state import NUM_PITCHES
+
+
+# The tempo of a midi file without any tempo-event (120 bpm).
+DEFAULT_MPQN = 500000
+
+# The note events of a track.
+# times: The absolute tick of each note event.
+# pitches: The pitch of each note event.
+# velocities: The velocity of each note event (0 for NoteOff).
+# end_of_track: Whether an EndOfTrack event was reached.
+# tempo_events: (absolute tick, event index, SetTempoEvent) for every tempo
+#  change of the track.
+TrackNotes = namedtuple('TrackNotes', [
+    'times', 'pitches', 'velocities', 'end_of_track', 'tempo_events'])
+
+
+def merge_note_events(tracks):
+    """
+    Merges the note events of tracks played at the same time, in order of
+    absolute tick (k-way merge, the events of a tick keep the order of their
+    tracks).
+    A pitch is only turned OFF once every track playing it has released it.
+    :param tracks: The note events of every track.
+    :type tracks: list of TrackNotes
+    :returns: The merged events (absolute tick, pitch, velocity).
+    :return_type: (1-D numpy array, 1-D numpy array, 1-D numpy array)
+    """
+    streams = [izip(track.times.tolist(), repeat(idx),
+                    track.pitches.tolist(), track.velocities.tolist())
+               for idx, track in enumerate(tracks)]
+    # The tracks holding each pitch ON.
+    holders = [set() for _ in xrange(NUM_PITCHES)]
+
+    times = []
+    pitches = []
+    velocities = []
+    for tick, idx, pitch, velocity in heapq.merge(*streams):
+        if velocity:
+            holders[pitch].add(idx)
+        else:
+            holders[pitch].discard(idx)
+            if holders[pitch]:
+                continue
+        times.append(tick)
+        pitches.append(pitch)
+        velocities.append(velocity)
+
+    return (np.array(times, dtype=np.int64), np.array(pitches, dtype=np.uint8),
+            np.array(velocities, dtype=np.uint8))
+
+
+def merge_tempo_events(tracks):
+    """
+    Collects the tempo changes of tracks played at the same time.
+    :param tracks: The note events of every track.
+    :type tracks: list of TrackNotes
+    :returns: The tempo changes (absolute tick, SetTempoEvent), in order.
+    :return_type: list
+    """
+    streams = [[(tick, idx, event) for tick, _, event in track.tempo_events]
+               for idx, track in enumerate(tracks)]
+    return [(tick, event) for tick, _, event in heapq.merge(*streams)]
+
+
+def initial_tempo_event(tempo_changes):
+    """
+    Finds the tempo-event in effect at the first tick.
+    :param tempo_changes: The tempo changes (absolute tick, SetTempoEvent).
+    :type tempo_changes: list
+    :returns: The tempo-event, or None for the default tempo.
+    :return_type: SetTempoEvent or None
+    """
+    ret = None
+    for tick, event in tempo_changes:
+        if tick > 0:
+            break
+        ret = event
+    return ret
+
+
+def retime(times, tempo_changes):
+    """
+    Rescales absolute ticks so that the whole sequence plays at its initial
+    tempo: a tick lasting twice as long as at the initial tempo counts as
+    two ticks.
+    :param times: The absolute ticks (non-decreasing).
+    :type times: 1-D numpy array
+    :param tempo_changes: The tempo changes (absolute tick, SetTempoEvent).
+    :type tempo_changes: list
+    :returns: The rescaled ticks.
+    :return_type: 1-D numpy array
+    """
+    times = np.asarray(times, dtype=np.int64)
+    if not tempo_changes:
+        return times
+
+    # The sequence is cut into segments of constant tempo.
+    starts = np.array([0] + [tick for tick, _ in tempo_changes],
+                      dtype=np.int64)
+    mpqns = np.array([DEFAULT_MPQN] + [event.mpqn
+                                       for _, event in tempo_changes],
+                     dtype=np.float64)
+    initial_event = initial_tempo_event(tempo_changes)
+    scales = mpqns / (initial_event.mpqn if initial_event else DEFAULT_MPQN)
+
+    # The rescaled tick at which each segment starts.
+    offsets = np.zeros(len(starts))
+    np.cumsum(np.diff(starts) * scales[:-1], out=offsets[1:])
+
+    segments = np.searchsorted(starts, times, side='right') - 1
+    return np.rint(offsets[segments] +
+                   (times - starts[segments]) * scales[segments]).astype(
+                       np.int64)
+
+
+def quantize(ticks, pitches, velocities, resolution, grid):
+    """
+    Snaps note events to the nearest row of a grid.
+    A note shorter than a row is kept 1 row long instead of vanishing.
+    :param ticks: The tick of each note event (non-decreasing).
+    :type ticks: 1-D numpy array
+    :param pitches: The pitch of each note event.
+    :type pitches: 1-D numpy array
+    :param velocities: The velocity of each note event (0 for NoteOff).
+    :type velocities: 1-D numpy array
+    :param resolution: The number of ticks per beat.
+    :type resolution: int
+    :param grid: The number of rows per beat.
+    :type grid: int
+    :returns: The note events, with the row of each one instead of its tick.
+    :return_type: (1-D numpy array, 1-D numpy array, 1-D numpy array)
+    """
+    rows = np.floor(np.asarray(ticks) * (float(grid) / resolution) +
+                    0.5).astype(np.int64)
+
+    # Find the events following an event of the same pitch (in order).
+    order = np.argsort(pitches, kind='mergesort')
+    same_pitch = np.zeros(len(order), dtype=bool)
+    same_pitch[1:] = pitches[order][1:] == pitches[order][:-1]
+    previous = np.roll(order, 1)
+    # NoteOff events landing on the row of their NoteOn move to the next row.
+    collapsed = order[same_pitch & (velocities[order] == 0) &
+                      (velocities[previous] > 0) &
+                      (rows[order] == rows[previous])]
+    rows[collapsed] += 1
+
+    order = np.argsort(rows, kind='mergesort')
+    return rows[order], pitches[order], velocities[order]
+
+
+def sequence_runs(tracks, tempo_changes, resolution=None, grid=None):
+    """
+    Merges tracks played at the same time into runs.
+    Like in midi_to_sequence(), the state-matrix ends at the last note event,
+    whose state is kept 1 tick if the tracks end properly.
+    :param tracks: The note events of every track.
+    :type tracks: list of TrackNotes
+    :param tempo_changes: The tempo changes (absolute tick, SetTempoEvent).
+    :type tempo_changes: list
+    :param resolution: The number of ticks per beat.
+    :type resolution: int or None
+    :param grid: The number of rows per beat to quantize to (None keeps one
+     row per tick).
+    :type grid: int or None
+    :returns: The runs.
+    :return_type: StateRuns
+    """
+    times, pitches, velocities = merge_note_events(tracks)
+    ticks = retime(times, tempo_changes)
+    if grid:
+        ticks, pitches, velocities = quantize(ticks, pitches, velocities,
+                                              resolution, grid)
+    nb_ticks = int(ticks[-1]) if len(ticks) else 0
+    nb_ticks += any(track.end_of_track for track in tracks)
+    return StateRuns.from_events(ticks, pitches, velocities, nb_ticks)
+
+
+def tracks_to_runs(tracks, format, resolution=None, grid=None):
+    """
+    Converts the tracks of a midi file to a single state-matrix.
+    :param tracks: The note events of every track.
+    :type tracks: list of TrackNotes
+    :param format: The format of the midi file (0, 1 or 2).
+    :type format: int
+    :param resolution: The number of ticks per beat of the file.
+    :type resolution: int or None
+    :param grid: The number of rows per beat to quantize to (None keeps one
+     row per tick).
+    :type grid: int or None
+    :returns: The state-matrix and the tempo-event it plays at.
+    :return_type: (StateRuns, SetTempoEvent or None)
+    """
+    if format == 2:
+        # Every track keeps its own tempo changes.
+        track_runs = [sequence_runs([track], merge_tempo_events([track]),
+                                    resolution, grid)
+                      for track in tracks]
+        tempo_event = initial_tempo_event(
+            merge_tempo_events(tracks[:1])) if tracks else None
+        return concatenate_runs(track_runs), tempo_event
+
+    tempo_changes = merge_tempo_events(tracks)
+    return (sequence_runs(tracks, tempo_changes, resolution, grid),
+            initial_tempo_event(tempo_changes))
+
+
+def main():
+    import midi
+    # Two tracks playing the same pitch, and a tempo halved at tick 4.
+    tempo_events = [(0, 0, midi.SetTempoEvent(tick=0, bpm=120)),
+                    (4, 1, midi.SetTempoEvent(tick=4, bpm=60))]
+    tracks = [
+        TrackNotes(np.array([0, 2, 6]), np.array([60, 60, 62], np.uint8),
+                   np.array([100, 0, 90], np.uint8), True, tempo_events),
+        TrackNotes(np.array([1, 3]), np.array([60, 60], np.uint8),
+                   np.array([80, 0], np.uint8), True, []),
+    ]
+    runs, tempo_event = tracks_to_runs(tracks, 1)
+    print runs.durations
+    print runs.states[:, [60, 62]]
+    assert(tempo_event.bpm == 120)
+    # Pitch 60 is held from tick 0 until both tracks release it (tick 3),
+    # pitch 62 starts at tick 6 = 4 + 2 * 2 rescaled ticks.
+    assert(np.array_equal(runs.to_state_matrix()[:, 60],
+                          [100, 80, 80, 0, 0, 0, 0, 0, 0]))
+    assert(np.array_equal(runs.to_state_matrix()[:, 62],
+                          [0] * 8 + [90]))
+
+    # At 4 ticks per beat and 1 row per beat, pitch 60 is held for less than
+    # a row (and re-struck within it) but still lasts 1 row.
+    runs, _ = tracks_to_runs(tracks, 1, resolution=4, grid=1)
+    print runs.states[:, [60, 62]]
+    assert(np.array_equal(runs.to_state_matrix()[:, 60], [80, 0, 0]))
+    assert(np.array_equal(runs.to_state_matrix()[:, 62], [0, 0, 90]))
+
+    # A note shorter than a row.
+    runs, _ = tracks_to_runs([TrackNotes(
+        np.array([5, 6]), np.array([60, 60], np.uint8),
+        np.array([100, 0], np.uint8), True, [])], 0, resolution=8, grid=1)
+    assert(np.array_equal(runs.to_state_matrix()[:, 60], [0, 100, 0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,83 +1,140 @@
 #!/usr/bin/env python2
 '''
 Convert integer-model to boolean and back.
+The volumes can be restored either as a single average, or from a table of
+the average volume of every pitch at every position of a cycle of rows
+(e.g. the rows of a beat), learned from the corpus.
 '''
+import numpy as np
+
 from midi_debug import *
+from midi_runs import StateRuns
+from midi_sequence import midi_to_sequence
+from midi_trace import traced
 
 
 def remove_volume_from_state(state):
     """
-    Converts the state vector to boolean format.
-    Assigns state[pitch] = 1 wherever state[pitch] != 0
-    :param state: The state vector.
-    :type state: list
+    Converts a state, or any number of states, to boolean format (in place).
+    Assigns state[...] = 1 wherever state[...] != 0
+    :param state: The state vector (or a whole state-matrix).
+    :type state: numpy array
     :returns: A tuple of (volume_sum, volume_num) signifying the
      sum of all the non-zero volumes and their frequency respectively.
     :return_type: (int, int)
     """
-    volume_sum = 0
-    volume_num = 0
+    volume_sum = int(state.sum(dtype=np.uint64))
+    volume_num = int(np.count_nonzero(state))
 
-    for pitch, volume in enumerate(state):
-        if volume > 0:
-            volume_sum += volume
-            volume_num += 1
-            state[pitch] = 1
+    np.minimum(state, 1, out=state)
 
     return (volume_sum, volume_num)
 
 
+@traced
 def remove_volume_from_state_matrix(state_matrix):
     """
-    Converts the state-matrix to boolean format.
+    Converts the state-matrix to boolean format (in place).
     Assigns state_matrix[pitch][volume] = 1 wherever
     state_matrix[pitch][volume] != 0
     :param state_matrix: The state-matrix.
-    :type state_matrix: 2-D list
-    :returns: The average of all the non-zero volumes encountered.
+    :type state_matrix: 2-D numpy array or StateRuns
+    :returns: The average of all the non-zero volumes encountered (0 if
+     there is none).
     :return_type: int
     """
-    volume_sum = 0
-    volume_num = 0
-
-    for idx, state in enumerate(state_matrix):
-        volume_sum_state, volume_num_state = remove_volume_from_state(state)
-
-        volume_sum += volume_sum_state
-        volume_num += volume_num_state
-
+    if isinstance(state_matrix, StateRuns):
+        # Every state counts as many times as the number of ticks it lasts.
+        states = state_matrix.states
+        durations = state_matrix.durations
+        volume_sum = int(np.dot(states.sum(axis=1, dtype=np.uint64),
+                                durations.astype(np.uint64)))
+        volume_num = int(np.dot(np.count_nonzero(states, axis=1), durations))
+        np.minimum(states, 1, out=states)
+    else:
+        # The state-matrix is processed as a single (flattened) state.
+        volume_sum, volume_num = remove_volume_from_state(state_matrix)
+
+    if not volume_num:
+        return 0
     volume_avg = (1.0 * volume_sum) / volume_num
 
     return int(volume_avg)
 
 
+def velocity_table(songs, period=1):
+    """
+    Learns the average volume of every pitch at every position of a cycle of
+    rows, the positions being counted from the start of each song.
+    :param songs: The state-matrices of the songs.
+    :type songs: list of 2-D numpy array or StateRuns
+    :param period: The number of rows of the cycle (1 only distinguishes the
+     pitches).
+    :type period: int
+    :returns: table[position][pitch] = average volume. Where a pitch is never
+     ON at a position, the average volume of all the notes is used.
+    :return_type: 2-D numpy array
+    """
+    volume_sums = 0
+    volume_nums = 0
+    for runs in songs:
+        if not isinstance(runs, StateRuns):
+            runs = StateRuns.from_state_matrix(runs)
+        # The number of rows of every run at every position.
+        positions = np.arange(period)
+        ends = runs.starts + runs.durations
+        counts = (ends[:, np.newaxis] - positions + period - 1) // period - \
+            (runs.starts[:, np.newaxis] - positions + period - 1) // period
+        volume_sums = volume_sums + np.dot(counts.T, runs.states.astype(
+            np.int64))
+        volume_nums = volume_nums + np.dot(counts.T, (runs.states > 0).astype(
+            np.int64))
+
+    volume_avg = float(np.sum(volume_sums)) / max(np.sum(volume_nums), 1)
+    table = np.where(volume_nums > 0,
+                     volume_sums / np.maximum(volume_nums, 1.), volume_avg)
+    return np.rint(table).clip(1, 127).astype(np.uint8)
+
+
 def insert_volume_into_state(state, volume_new):
     """
-    Converts the state vector to integer format from boolean.
+    Converts the state vector to integer format from boolean (in place).
     Assigns state[pitch] = volume_new wherever state[pitch] != 0
     :param state: The state vector.
-    :type state: list
+    :type state: 1-D numpy array
     :param volume_new: The new volume to be assigned to all the non-zero cells.
     :type volume_new: int
     :returns: None
     """
-    for pitch, volume in enumerate(state):
-        state[pitch] = state[pitch] * volume_new
+    state *= volume_new
 
 
-def insert_volume_into_state_matrix(state_matrix, volume_new):
+@traced
+def insert_volume_into_state_matrix(state_matrix, volume_new, start=0):
     """
-    Converts the state-matrix to integer format from boolean.
+    Converts the state-matrix to integer format from boolean (in place).
     Assigns state_matrix[pitch][volume] = volume_new wherever
     state_matrix[pitch][volume] != 0
     :param state_matrix: The state-matrix.
-    :type state_matrix: 2-D list
-    :param volume_new: The new volume to be assigned to all the non-zero cells.
-    :type volume_new: int
+    :type state_matrix: 2-D numpy array or StateRuns
+    :param volume_new: The new volume to be assigned to all the non-zero
+     cells, or a velocity table (see velocity_table()).
+    :type volume_new: int or 2-D numpy array
+    :param start: The position in the cycle of the velocity table of the
+     first row.
+    :type start: int
     :returns: None
     """
-    for idx, state in enumerate(state_matrix):
-        insert_volume_into_state(state, volume_new)
+    if isinstance(state_matrix, StateRuns):
+        if np.ndim(volume_new) == 2 and len(volume_new) > 1:
+            raise ValueError('A velocity table with several positions needs '
+                             'a dense state-matrix')
+        state_matrix = state_matrix.states
+    if np.ndim(volume_new) == 2:
+        period = len(volume_new)
+        volume_new = volume_new[
+            (start + np.arange(len(state_matrix))) % period]
+    insert_volume_into_state(state_matrix, volume_new)
 
 
 def main():
@@ -96,6 +153,19 @@ def main():
     print desparsify_state_matrix(state_matrix)
     print '\n\n\n'
 
+    state_matrix, _ = midi_to_sequence(filepath)
+    table = velocity_table([state_matrix], period=2)
+    boolean_state_matrix = state_matrix.copy()
+    remove_volume_from_state_matrix(boolean_state_matrix)
+    insert_volume_into_state_matrix(boolean_state_matrix, table)
+    print desparsify_state_matrix(boolean_state_matrix)
+    for position in xrange(2):
+        rows = state_matrix[position::2]
+        played = rows > 0
+        assert(np.array_equal(
+            boolean_state_matrix[position::2][played],
+            np.broadcast_to(table[position], rows.shape)[played]))
+
 
 if __name__ == '__main__':
     main()
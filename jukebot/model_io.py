@@ -0,0 +1,110 @@
+#!/usr/bin/env python2
+'''
+Saving and loading of the model, along with the preprocessing meta-data
+it was trained with.
+Keras is only imported when a model is actually loaded.
+'''
+import errno
+import json
+import os
+
+
+# Default location for saving (serializing) the model, and the files the
+# model is saved as inside it.
+model_save_dir = os.path.join('models', 'model_save')
+model_arch_file = 'arch.json'
+model_weights_file = 'weights.h5'
+model_meta_file = 'meta.json'
+model_chords_file = 'chords.npz'
+
+
+def mkdir_p(path):
+    """
+    Create all the intermediate directories in a path.
+    Similar to the `mkdir -p` command.
+    """
+    try:
+        os.makedirs(path)
+    except OSError as exc:  # Python >2.5
+        if exc.errno == errno.EEXIST and os.path.isdir(path):
+            pass
+        else:
+            raise
+
+
+def model_exists(model_dir=model_save_dir):
+    """
+    Checks whether a model has been saved.
+    :param model_dir: The directory of the model.
+    :type model_dir: str
+    :returns: Whether a model has been saved.
+    :return_type: bool
+    """
+    return os.path.exists(os.path.join(model_dir, model_arch_file))
+
+
+def save_model(model, model_dir=model_save_dir):
+    """
+    Saves (serializes) the model.
+    Mostly adapted from Keras documentation.
+    :param model: The model to save.
+    :type model: Keras model type
+    :param model_dir: The directory of the model.
+    :type model_dir: str
+    :returns: None.
+    """
+    # Ensure that the directory exists!
+    mkdir_p(model_dir)
+
+    json_string = model.to_json()
+
+    open(os.path.join(model_dir, model_arch_file), 'w').write(json_string)
+    model.save_weights(os.path.join(model_dir, model_weights_file))
+
+
+def save_model_meta(meta, model_dir=model_save_dir):
+    """
+    Saves the preprocessing meta-data the model was trained with
+    (e.g. the columns kept by column-compression), so that it can be used
+    without preprocessing the corpus again.
+    :param meta: The meta-data.
+    :type meta: dict
+    :param model_dir: The directory of the model.
+    :type model_dir: str
+    :returns: None.
+    """
+    mkdir_p(model_dir)
+    with open(os.path.join(model_dir, model_meta_file), 'w') as meta_file:
+        json.dump(meta, meta_file, indent=1)
+
+
+def load_model_meta(model_dir=model_save_dir):
+    """
+    Loads the preprocessing meta-data the model was trained with.
+    :param model_dir: The directory of the model.
+    :type model_dir: str
+    :returns: The meta-data, or None if it was not saved with the model.
+    :return_type: dict or None
+    """
+    meta_path = os.path.join(model_dir, model_meta_file)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as meta_file:
+        return json.load(meta_file)
+
+
+def load_model(model_dir=model_save_dir):
+    """
+    Loads (deserializes) the model.
+    Mostly adapted from Keras documentation.
+    :param model_dir: The directory of the model.
+    :type model_dir: str
+    :returns: The model.
+    :return_type: Keras model type
+    """
+    from keras.models import model_from_json
+
+    model = model_from_json(
+        open(os.path.join(model_dir, model_arch_file)).read())
+    model.load_weights(os.path.join(model_dir, model_weights_file))
+    return model